@@ -0,0 +1,221 @@
+"""
+Headless batch analysis of WhatsApp exports.
+
+Analyses every export in a directory on a pool of worker processes and writes one
+JSON file of metrics per chat (plus the rendered graphs when asked to), e.g.
+
+    python batch_analyser.py exports/ --output reports/ --workers 8 --figures
+
+With --save each preprocessed chat is also written next to its report as an Arrow file,
+which the web app and later batches load far faster than the text export.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+import traceback
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+EXPORT_EXTENSIONS = ('.txt', '.zip', '.arrow', '.feather', '.parquet')
+TOP_REPLY_PAIRS = 10
+LATENCY_QUANTILES = [0.5, 0.9, 0.99]
+
+
+def find_exports(input_path : str):
+    if os.path.isfile(input_path):
+        return [input_path]
+    paths = []
+    for root, _, files in os.walk(input_path):
+        paths.extend(os.path.join(root, name) for name in files if name.lower().endswith(EXPORT_EXTENSIONS))
+    return sorted(paths)
+
+
+def report_names(paths : list):
+    """
+    Name of each export's report: its path relative to the directory all the exports are in, without the
+    extension unless another export only differs by it. iOS calls every export _chat.txt, so the name
+    alone would make exports in different directories overwrite each other's reports.
+    """
+    root = os.path.commonpath([os.path.dirname(os.path.abspath(path)) for path in paths])
+    relative_paths = [os.path.relpath(os.path.abspath(path), root) for path in paths]
+    stems = [os.path.splitext(relative_path)[0] for relative_path in relative_paths]
+    stem_counts = Counter(stems)
+    return {
+        path: stem if stem_counts[stem] == 1 else relative_path
+        for path, relative_path, stem in zip(paths, relative_paths, stems)
+    }
+
+
+def quantile_metrics(quantiles, subject):
+    if subject not in quantiles.index:
+        return None
+    return {f'p{round(quantile * 100)}': float(quantiles.loc[subject, quantile]) for quantile in quantiles.columns}
+
+
+def chat_metrics(aggregates):
+    messages = aggregates.by_subject('Messages')
+    replies = aggregates.by_subject('Replies')
+    reply_time_sums = aggregates.by_subject('Reply time sum')
+    weekly_messages = aggregates.weekly('Messages').sum(axis=1)
+    conversations = aggregates.conversation_sizes()
+    reply_pairs = aggregates.reply_pairs().head(TOP_REPLY_PAIRS)
+    reply_quantiles = aggregates.latency_quantiles('Reply time', LATENCY_QUANTILES)
+    gap_quantiles = aggregates.latency_quantiles('Inter conv time', LATENCY_QUANTILES)
+    return {
+        'messages': int(messages.sum()),
+        'participants': len(messages),
+        'start_date': aggregates.start_date.isoformat(),
+        'end_date': aggregates.end_date.isoformat(),
+        'conversations': len(conversations),
+        'average_conversation_size': float(conversations['count'].mean()),
+        'busiest_week': weekly_messages.idxmax().strftime('%Y-%m-%d'),
+        'busiest_week_messages': int(weekly_messages.max()),
+        'subjects': {
+            subject: {
+                'messages': int(messages[subject]),
+                'average_words': float(aggregates.average_words()[subject]),
+                'average_characters': float(aggregates.by_subject('Characters')[subject] / messages[subject]),
+                'emojis': int(aggregates.by_subject('Emojis')[subject]),
+                'links': int(aggregates.by_subject('Links')[subject]),
+                'media': int(aggregates.by_subject('Media')[subject]),
+                'deleted': int(aggregates.by_subject('Deleted')[subject]),
+                # Averaged over the replies only, the reply time of every other message is 0
+                'average_reply_time': (float(reply_time_sums[subject] / replies[subject])
+                                       if replies[subject] > 0 else None),
+                'conversations_started': int(aggregates.by_subject('Conv starts')[subject]),
+                'reply_time_quantiles': quantile_metrics(reply_quantiles, subject),
+                'inter_conversation_time_quantiles': quantile_metrics(gap_quantiles, subject),
+            }
+            for subject in messages.index
+        },
+        'top_reply_pairs': [
+            {
+                'from': str(replier),
+                'to': str(replied_to),
+                'replies': int(pair['Replies']),
+                'average_reply_time': float(pair['Average reply time']),
+                'max_reply_time': float(pair['Reply time max']),
+            }
+            for (replier, replied_to), pair in reply_pairs.iterrows()
+        ],
+    }
+
+
+def memory_metrics(df):
+    # Imported here like the rest of the analysis modules, so the parent process never loads them
+    from processing.compact import memory_report
+
+    return {column: int(row['bytes']) for column, row in memory_report(df).iterrows()}
+
+
+def render_figures(aggregates, figures_dir : str):
+    # Imported here so metrics only runs never pay for matplotlib
+    from components.graph_components import GRAPHS
+    from components.render_cache import render_graph
+
+    os.makedirs(figures_dir, exist_ok=True)
+    figure_paths = {}
+    for graph in GRAPHS:
+        png, _ = render_graph(aggregates, aggregates.subjects, graph)
+        figure_paths[graph] = os.path.join(figures_dir, f'{graph}.png')
+        with open(figure_paths[graph], 'wb') as file:
+            file.write(png)
+    return figure_paths
+
+
+def analyse_export(path : str, name : str, output_dir : str, figures : bool, inter_conversation_threshold_time : int,
+                   save : bool = False):
+    """
+    Runs in a worker process, writing the report to name.json, the figures to name/ and, when saving,
+    the preprocessed chat to name.arrow in output_dir.
+    Any failure is reported back instead of raised so one bad file can't stop the batch.
+    """
+    started = time.perf_counter()
+    report = {'file': path, 'report': f'{name}.json', 'status': 'ok'}
+    try:
+        from data_utils import parse_and_preprocess
+        from processing.aggregates import ChatAggregates
+        from processing.storage import save_chat
+
+        # The Streamlit cache behind get_df_from_data would only hold on to memory in a worker
+        with open(path, 'rb') as raw_file_content:
+            df = parse_and_preprocess(raw_file_content, inter_conversation_threshold_time)
+        report['unparsed_messages'] = int(df.attrs.get('unparsed messages', 0))
+        aggregates = ChatAggregates.from_df(df)
+        report['memory_bytes'] = memory_metrics(df)
+        if save:
+            report['saved'] = os.path.join(output_dir, f'{name}.arrow')
+            os.makedirs(os.path.dirname(report['saved']), exist_ok=True)
+            save_chat(df, report['saved'])
+        del df
+        report['metrics'] = chat_metrics(aggregates)
+        if figures:
+            report['figures'] = render_figures(aggregates, os.path.join(output_dir, name))
+    except Exception as error:
+        report['status'] = 'error'
+        report['error'] = repr(error)
+        report['traceback'] = traceback.format_exc()
+    report['seconds'] = round(time.perf_counter() - started, 3)
+
+    report_path = os.path.join(output_dir, f'{name}.json')
+    os.makedirs(os.path.dirname(report_path), exist_ok=True)
+    with open(report_path, 'w') as file:
+        json.dump(report, file, indent=2)
+    return report
+
+
+def run_batch(paths : list, output_dir : str, workers : int = None, figures : bool = False,
+              inter_conversation_threshold_time : int = 60, save : bool = False):
+    os.makedirs(output_dir, exist_ok=True)
+    names = report_names(paths)
+    reports = []
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {
+            executor.submit(analyse_export, path, names[path], output_dir, figures,
+                            inter_conversation_threshold_time, save): path
+            for path in paths
+        }
+        for done, future in enumerate(as_completed(futures), start=1):
+            try:
+                report = future.result()
+            except Exception as error:
+                # Only reached when the worker itself died, e.g. killed for running out of memory
+                report = {'file': futures[future], 'status': 'error', 'error': repr(error)}
+            reports.append(report)
+            print(f"[{done}/{len(paths)}] {report['status']:5} {report['file']} "
+                  f"{report.get('seconds', '')}{report.get('error', '')}", file=sys.stderr)
+
+    summary = {
+        'files': len(reports),
+        'failed': sum(report['status'] != 'ok' for report in reports),
+        'reports': sorted(reports, key=lambda report: report['file']),
+    }
+    with open(os.path.join(output_dir, 'summary.json'), 'w') as file:
+        json.dump(summary, file, indent=2)
+    return summary
+
+
+def main(argv : list = None):
+    parser = argparse.ArgumentParser(description='Analyse a directory of WhatsApp exports without the web app')
+    parser.add_argument('input', help='Export file or directory to search for exports')
+    parser.add_argument('-o', '--output', default='reports', help='Directory the JSON reports are written to')
+    parser.add_argument('-j', '--workers', type=int, default=None, help='Worker processes, defaults to every core')
+    parser.add_argument('--figures', action='store_true', help='Also render every graph as a PNG')
+    parser.add_argument('--save', action='store_true',
+                        help='Also write every preprocessed chat as an Arrow file the app can load')
+    parser.add_argument('--threshold', type=int, default=60,
+                        help='Minutes of silence that start a new conversation')
+    args = parser.parse_args(argv)
+
+    paths = find_exports(args.input)
+    if len(paths) == 0:
+        parser.error(f'No exports found in {args.input}')
+    summary = run_batch(paths, args.output, args.workers, args.figures, args.threshold, args.save)
+    print(f"Analysed {summary['files']} chats, {summary['failed']} failed", file=sys.stderr)
+    return 1 if summary['failed'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,110 @@
+"""
+Compares the two chart backends on synthetic chats of increasing size: the server CPU time each
+graph takes and the bytes sent to the browser for it, a PNG for matplotlib and a JSON spec for
+Vega-Lite, e.g.
+
+    python -m benchmarks.chart_backends --scales 10000 100000 1000000 --output charts.json
+    python -m benchmarks.chart_backends --scales 10000 --compare charts.json
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+from benchmarks.run_benchmarks import add_results_arguments, compare_metrics, environment, write_results
+from benchmarks.synthetic_chat import write_chat
+from components.graph_components import GRAPHS
+from components.render_cache import render_graph
+from components.vega_components import chart_spec
+from data_utils import create_df_from_raw_file, preprocess_df
+from processing.aggregates import ChatAggregates
+
+DEFAULT_SCALES = [10_000, 100_000, 1_000_000]
+REPEATS = 3
+
+
+def matplotlib_payload(aggregates : ChatAggregates, graph : str):
+    png, _ = render_graph(aggregates, aggregates.subjects, graph)
+    return png
+
+
+def vega_payload(aggregates : ChatAggregates, graph : str):
+    spec, _ = chart_spec(aggregates, aggregates.subjects, graph)
+    # Streamlit sends specs to the browser as JSON
+    return json.dumps(spec).encode('utf-8')
+
+
+BACKENDS = {'matplotlib': matplotlib_payload, 'vega-lite': vega_payload}
+
+
+def measure(payload, aggregates : ChatAggregates, graph : str, repeats : int = REPEATS):
+    """Fewest CPU seconds of repeats runs, so other processes and the first run's imports don't count."""
+    cpu_seconds = []
+    for _ in range(repeats):
+        started = time.process_time()
+        sent = payload(aggregates, graph)
+        cpu_seconds.append(time.process_time() - started)
+    return {'cpu_seconds': round(min(cpu_seconds), 6), 'bytes': len(sent)}
+
+
+def benchmark_scale(path : str, repeats : int = REPEATS):
+    with open(path, 'rb') as raw_file_content:
+        df = preprocess_df(create_df_from_raw_file(raw_file_content))
+    aggregates = ChatAggregates.from_df(df)
+    results = {}
+    for graph in GRAPHS:
+        results[graph] = {backend: measure(payload, aggregates, graph, repeats) for backend, payload in BACKENDS.items()}
+        print(f'  {graph:40}' + ''.join(
+            f" {backend} {measurement['cpu_seconds'] * 1000:8.1f}ms {measurement['bytes'] / 1024:8.1f}KB"
+            for backend, measurement in results[graph].items()
+        ), file=sys.stderr)
+    return results
+
+
+def totals(graphs : dict):
+    return {
+        backend: {
+            metric: sum(graph[backend][metric] for graph in graphs.values()) for metric in ('cpu_seconds', 'bytes')
+        }
+        for backend in BACKENDS
+    }
+
+
+def compare(results : dict, baseline : dict, tolerance : float):
+    """Prints the CPU time and bytes ratio of every graph and backend against a previous run, returns the regressed ones."""
+    regressions = []
+    for scale, graphs in results['scales'].items():
+        for graph, backends in graphs.items():
+            for backend, measurement in backends.items():
+                previous = baseline.get('scales', {}).get(scale, {}).get(graph, {}).get(backend)
+                regressions.extend(compare_metrics(f'{scale:>10} {graph:40} {backend:10}', measurement, previous,
+                                                   ['cpu_seconds', 'bytes'], tolerance))
+    return regressions
+
+
+def main(argv : list = None):
+    parser = argparse.ArgumentParser(description='Compare server CPU time and bytes sent of the chart backends')
+    parser.add_argument('--scales', type=int, nargs='+', default=DEFAULT_SCALES, help='Message counts to run')
+    parser.add_argument('--participants', type=int, default=2)
+    parser.add_argument('--repeats', type=int, default=REPEATS)
+    add_results_arguments(parser)
+    args = parser.parse_args(argv)
+
+    results = {'environment': environment(), 'parameters': vars(args), 'scales': {}, 'totals': {}}
+    with tempfile.TemporaryDirectory() as directory:
+        for scale in args.scales:
+            print(f'{scale} messages', file=sys.stderr)
+            path = write_chat(os.path.join(directory, f'chat_{scale}.txt'), scale, participants=args.participants)
+            results['scales'][str(scale)] = benchmark_scale(path, args.repeats)
+            results['totals'][str(scale)] = totals(results['scales'][str(scale)])
+            os.remove(path)
+            for backend, total in results['totals'][str(scale)].items():
+                print(f"  {'all graphs':40} {backend} {total['cpu_seconds'] * 1000:8.1f}ms {total['bytes'] / 1024:8.1f}KB",
+                      file=sys.stderr)
+    return write_results(results, args, compare)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
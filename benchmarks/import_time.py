@@ -0,0 +1,110 @@
+"""
+Times the cold start of the app's modules, each imported in a fresh interpreter, e.g.
+
+    python -m benchmarks.import_time --output imports.json
+    python -m benchmarks.import_time --compare imports.json
+
+Reports the wall time and resident memory each import adds on top of a bare interpreter,
+plus the slowest modules it pulled in according to python -X importtime.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+DEFAULT_MODULES = [
+    'controllers.view_controller',
+    'data_utils',
+    'components.render_cache',
+    'components.graph_components',
+    'batch_analyser',
+]
+REPEATS = 5
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Runs in the child interpreter, printing how long the import took and the peak resident memory after it.
+# Linux carries ru_maxrss over from the parent through fork and exec, VmHWM only covers the child itself
+IMPORT_SCRIPT = """
+import json, resource, sys, time
+started = time.perf_counter()
+{statement}
+seconds = time.perf_counter() - started
+try:
+    with open('/proc/self/status') as status:
+        peak = next(int(line.split()[1]) * 1024 for line in status if line.startswith('VmHWM:'))
+except OSError:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+print(json.dumps({{'seconds': seconds, 'peak_bytes': peak}}))
+"""
+
+
+def import_once(module : str = None):
+    """Imports module in a new interpreter, returns (measurement, slowest imported modules)."""
+    statement = f'import {module}' if module else 'pass'
+    completed = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', IMPORT_SCRIPT.format(statement=statement)],
+        cwd=ROOT, capture_output=True, text=True, check=True
+    )
+    return json.loads(completed.stdout.strip().splitlines()[-1]), parse_importtime(completed.stderr)
+
+
+def parse_importtime(stderr : str, top : int = 10):
+    """The modules with the highest cumulative import time that were imported directly by the measured import."""
+    imported = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        # Lines are indented by nesting, the modules the measured import pulled in directly have three spaces
+        if len(name) - len(name.lstrip()) == 3:
+            imported.append((name.strip(), int(cumulative) / 1e6))
+    return dict(sorted(imported, key=lambda module: -module[1])[:top])
+
+
+def benchmark_import(module : str, baseline : dict, repeats : int = REPEATS):
+    runs = [import_once(module) for _ in range(repeats)]
+    # The fastest run is the one least disturbed by whatever else the machine was doing
+    measurement, slowest_imports = min(runs, key=lambda run: run[0]['seconds'])
+    return {
+        'seconds': round(measurement['seconds'], 6),
+        'peak_bytes': measurement['peak_bytes'],
+        'added_peak_bytes': measurement['peak_bytes'] - baseline['peak_bytes'],
+        'slowest_imports': {name: round(seconds, 6) for name, seconds in slowest_imports.items()},
+    }
+
+
+def compare(results : dict, baseline : dict, tolerance : float):
+    """Prints the time and memory ratios of every module against a previous run and returns the regressed ones."""
+    from benchmarks.run_benchmarks import compare_metrics
+
+    regressions = []
+    for module, measurement in results['modules'].items():
+        previous = baseline.get('modules', {}).get(module)
+        regressions.extend(compare_metrics(f'{module:35}', measurement, previous, ['seconds', 'added_peak_bytes'],
+                                           tolerance))
+    return regressions
+
+
+def main(argv : list = None):
+    parser = argparse.ArgumentParser(description="Measure the cold start time and memory of the app's modules")
+    parser.add_argument('modules', nargs='*', default=DEFAULT_MODULES, help='Modules to import')
+    parser.add_argument('--repeats', type=int, default=REPEATS, help='Fresh interpreters per module')
+    # Imported here since it pulls in everything this benchmark measures
+    from benchmarks.run_benchmarks import add_results_arguments, environment, write_results
+
+    add_results_arguments(parser)
+    args = parser.parse_args(argv)
+
+    interpreter, _ = min((import_once() for _ in range(args.repeats)), key=lambda run: run[0]['seconds'])
+    results = {'environment': environment(), 'interpreter': interpreter, 'modules': {}}
+    for module in args.modules:
+        results['modules'][module] = benchmark_import(module, interpreter, args.repeats)
+        measurement = results['modules'][module]
+        print(f"{module:35} {measurement['seconds']:8.3f}s {measurement['added_peak_bytes'] / 2 ** 20:8.1f}MB",
+              file=sys.stderr)
+    return write_results(results, args, compare)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
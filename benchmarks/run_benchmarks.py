@@ -0,0 +1,176 @@
+"""
+Times and memory-profiles every processing stage on synthetic chats of increasing size, e.g.
+
+    python -m benchmarks.run_benchmarks --scales 10000 100000 1000000 --output results.json
+    python -m benchmarks.run_benchmarks --scales 10000 --compare results.json
+
+Each stage runs once untraced for its time and once under tracemalloc for its peak
+memory, since tracing allocations slows the code it measures down.
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import matplotlib
+matplotlib.use('Agg')
+import matplotlib.pyplot as plt
+import numpy as np
+import pandas as pd
+
+from benchmarks.synthetic_chat import write_chat
+from components.graph_components import GraphComponents, GRAPHS, default_graph_params
+from data_utils import create_df_from_raw_file, preprocess_df, cluster_into_conversations, find_replies
+from processing.aggregates import ChatAggregates
+
+DEFAULT_SCALES = [10_000, 100_000, 1_000_000]
+REGRESSION_TOLERANCE = 0.2
+
+
+def measure(function, *args):
+    """Returns (result, seconds, peak traced bytes) of calling function(*args) twice, once traced."""
+    started = time.perf_counter()
+    result = function(*args)
+    seconds = time.perf_counter() - started
+    del result
+
+    tracemalloc.start()
+    result = function(*args)
+    _, peak_bytes = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, seconds, peak_bytes
+
+
+def parse_file(path : str):
+    with open(path, 'rb') as raw_file_content:
+        return create_df_from_raw_file(raw_file_content)
+
+
+def render_graph(graphs : GraphComponents, graph : str, aggregates : ChatAggregates):
+    result = getattr(graphs, graph)(aggregates)
+    fig = result[0] if isinstance(result, tuple) else result
+    # Rasterising is part of the cost users wait for
+    fig.canvas.draw()
+    plt.close(fig)
+
+
+def benchmark_scale(path : str):
+    stages = {}
+
+    def record(stage, function, *args):
+        result, seconds, peak_bytes = measure(function, *args)
+        stages[stage] = {'seconds': round(seconds, 6), 'peak_bytes': int(peak_bytes)}
+        print(f'  {stage:55} {seconds:10.4f}s {peak_bytes / 2 ** 20:10.1f}MB', file=sys.stderr)
+        return result
+
+    df = record('create_df_from_raw_file', parse_file, path)
+    # Each stage gets its own copy since preprocessing adds columns in place
+    record('cluster_into_conversations', cluster_into_conversations, df)
+    df = record('preprocess_df', lambda: preprocess_df(df.copy()))
+    record('find_replies', find_replies, df)
+    aggregates = record('ChatAggregates.from_df', ChatAggregates.from_df, df)
+    graphs = GraphComponents(default_graph_params(aggregates.subjects))
+    for graph in GRAPHS:
+        record(f'GraphComponents.{graph}', render_graph, graphs, graph, aggregates)
+    return stages
+
+
+def environment():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True).stdout.strip()
+    except OSError:
+        commit = None
+    return {
+        'commit': commit,
+        'python': platform.python_version(),
+        'pandas': pd.__version__,
+        'numpy': np.__version__,
+        'machine': platform.machine(),
+        'processor': platform.processor(),
+        'cpus': os.cpu_count(),
+    }
+
+
+def add_results_arguments(parser : argparse.ArgumentParser):
+    """The output and comparison options every benchmark shares, see write_results."""
+    parser.add_argument('--output', help='Where to write the JSON results, defaults to stdout')
+    parser.add_argument('--compare', help='Previous results to compare against, exits 1 on regressions')
+    parser.add_argument('--tolerance', type=float, default=REGRESSION_TOLERANCE)
+
+
+def compare_metrics(label : str, measurement : dict, previous : dict, metrics : list,
+                    tolerance : float = REGRESSION_TOLERANCE):
+    """
+    Prints the ratio of each metric of measurement to the same metric of previous, its measurement in the run
+    compared against, and returns (label, metric, ratio) of those over 1 + tolerance.
+    """
+    regressions = []
+    if previous is None:
+        return regressions
+    for metric in metrics:
+        if previous.get(metric, 0) <= 0:
+            continue
+        ratio = measurement[metric] / previous[metric]
+        flag = ' REGRESSION' if ratio > 1 + tolerance else ''
+        print(f'{label} {metric:18} {ratio:6.2f}x{flag}')
+        if flag:
+            regressions.append((label.strip(), metric, ratio))
+    return regressions
+
+
+def write_results(results : dict, args : argparse.Namespace, compare):
+    """
+    Writes results where --output says and, given --compare, checks them against that earlier run with
+    compare(results, baseline, tolerance). Returns the exit code, 1 when there were regressions.
+    """
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(results, file, indent=2)
+    else:
+        json.dump(results, sys.stdout, indent=2)
+
+    if args.compare:
+        with open(args.compare) as file:
+            regressions = compare(results, json.load(file), args.tolerance)
+        return 1 if regressions else 0
+    return 0
+
+
+def compare(results : dict, baseline : dict, tolerance : float = REGRESSION_TOLERANCE):
+    """Prints the time ratio of every stage against a previous run and returns the regressed ones."""
+    regressions = []
+    for scale, stages in results['scales'].items():
+        for stage, measurement in stages.items():
+            previous = baseline.get('scales', {}).get(scale, {}).get(stage)
+            regressions.extend(compare_metrics(f'{scale:>10} {stage:55}', measurement, previous, ['seconds'],
+                                               tolerance))
+    return regressions
+
+
+def main(argv : list = None):
+    parser = argparse.ArgumentParser(description='Benchmark the chat processing pipeline on synthetic exports')
+    parser.add_argument('--scales', type=int, nargs='+', default=DEFAULT_SCALES, help='Message counts to run')
+    parser.add_argument('--participants', type=int, default=2)
+    parser.add_argument('--dialect', default='English')
+    parser.add_argument('--distribution', default='bursty')
+    add_results_arguments(parser)
+    args = parser.parse_args(argv)
+
+    results = {'environment': environment(), 'parameters': vars(args), 'scales': {}}
+    with tempfile.TemporaryDirectory() as directory:
+        for scale in args.scales:
+            print(f'{scale} messages', file=sys.stderr)
+            path = write_chat(os.path.join(directory, f'chat_{scale}.txt'), scale, participants=args.participants,
+                              dialect=args.dialect, distribution=args.distribution)
+            results['scales'][str(scale)] = benchmark_scale(path)
+            os.remove(path)
+    return write_results(results, args, compare)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,86 @@
+"""
+Generates synthetic WhatsApp exports of any size for benchmarking, e.g.
+
+    python -m benchmarks.synthetic_chat chat.txt --messages 1000000 --participants 5 --dialect German
+"""
+import argparse
+
+import numpy as np
+import pandas as pd
+
+from processing.dialects import DIALECTS
+
+WORDS = np.array(['hey', 'ok', 'lol', 'yes', 'no', 'maybe', 'tomorrow', 'dinner', 'haha', 'sure', 'what', 'why',
+                  'coffee', 'work', 'later', 'love', 'see', 'you', 'there', 'now'])
+CHUNK_SIZE = 100_000
+DISTRIBUTIONS = ('bursty', 'uniform')
+
+
+def message_timestamps(messages : int, distribution : str, rng : np.random.Generator,
+                       start : str = '2015-01-01'):
+    """
+    Sorted message timestamps. 'bursty' chats alternate conversations of messages a
+    minute or so apart with silences of hours, 'uniform' ones spread messages evenly
+    over one year per hundred thousand messages.
+    """
+    start = np.datetime64(start, 's')
+    if distribution == 'uniform':
+        span = max(messages // 100_000, 1) * 365 * 24 * 3600
+        offsets = np.sort(rng.integers(0, span, messages))
+    else:
+        gaps = rng.exponential(60, messages)
+        # Roughly one message in twenty starts a new conversation
+        silences = rng.random(messages) < 0.05
+        gaps[silences] = rng.exponential(6 * 3600, int(silences.sum()))
+        offsets = np.cumsum(gaps).astype(np.int64)
+    return start + offsets.astype('timedelta64[s]')
+
+
+def iter_chat_chunks(messages : int, participants : int = 2, dialect : str = 'English',
+                     multiline_ratio : float = 0.02, distribution : str = 'bursty', seed : int = 0):
+    """Yields the export text in chunks of CHUNK_SIZE messages, so 10M message chats never sit in memory at once."""
+    export_dialect = DIALECTS[dialect]
+    rng = np.random.default_rng(seed)
+    subjects = np.array([f'Person {index}' for index in range(participants)])
+    timestamps = message_timestamps(messages, distribution, rng)
+    for chunk_start in range(0, messages, CHUNK_SIZE):
+        chunk_timestamps = pd.DatetimeIndex(timestamps[chunk_start:chunk_start + CHUNK_SIZE])
+        size = len(chunk_timestamps)
+        dates = chunk_timestamps.strftime(export_dialect.datetime_format)
+        senders = subjects[rng.integers(0, participants, size)]
+        lengths = rng.geometric(0.3, size)
+        words = WORDS[rng.integers(0, len(WORDS), int(lengths.sum()))]
+        splits = np.cumsum(lengths)[:-1]
+        multiline = rng.random(size) < multiline_ratio
+        lines = []
+        for date, sender, message_words, is_multiline in zip(dates, senders, np.split(words, splits), multiline):
+            text = ' '.join(message_words)
+            if is_multiline:
+                text = f'{text}\n{text}'
+            lines.append(export_dialect.header.format(date=date) + f'{sender}: {text}\n')
+        yield ''.join(lines)
+
+
+def write_chat(path : str, messages : int, **kwargs):
+    with open(path, 'w', encoding='utf-8') as file:
+        for chunk in iter_chat_chunks(messages, **kwargs):
+            file.write(chunk)
+    return path
+
+
+def main(argv : list = None):
+    parser = argparse.ArgumentParser(description='Write a synthetic WhatsApp export')
+    parser.add_argument('output', help='Path of the export to write')
+    parser.add_argument('--messages', type=int, default=100_000)
+    parser.add_argument('--participants', type=int, default=2)
+    parser.add_argument('--dialect', default='English', choices=list(DIALECTS))
+    parser.add_argument('--multiline-ratio', type=float, default=0.02)
+    parser.add_argument('--distribution', default='bursty', choices=DISTRIBUTIONS)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+    write_chat(args.output, args.messages, participants=args.participants, dialect=args.dialect,
+               multiline_ratio=args.multiline_ratio, distribution=args.distribution, seed=args.seed)
+
+
+if __name__ == '__main__':
+    main()
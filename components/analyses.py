@@ -0,0 +1,104 @@
+from processing.sessions import SESSION_COLUMNS
+
+# Participants shown in the reply heatmap, bigger groups are cut down to the most active ones
+REPLY_HEATMAP_SIZE = 20
+# Quantiles of the gaps before each conversation, labelled for the legend
+CONVERSATION_GAP_QUANTILES = {0.5: 'Usually', 0.9: '1 in 10 times', 0.99: '1 in 100 times'}
+
+
+class Analysis:
+    """
+    One section of the analysis page: the GraphComponents graph it shows, the text
+    around it and the derived columns (see data_utils.DERIVED_COLUMNS) its graph reads,
+    so preprocessing can skip whatever no open section needs.
+    describe is called with the extras the graph returned and the selected date range.
+    """
+    def __init__(self, graph : str, title : str, describe, columns : list = (), wide : bool = True,
+                 default : bool = False):
+        self.graph = graph
+        self.title = title
+        self.describe = describe
+        self.columns = list(columns)
+        self.wide = wide
+        self.default = default
+        # Graphs that don't read any session column look the same whatever the threshold is
+        self.uses_threshold = any(column in SESSION_COLUMNS for column in self.columns)
+
+
+ANALYSES = [
+    Analysis(
+        'create_messages_per_week_graph',
+        "When did you talk the most?",
+        lambda extras, start_date, end_date: f"This is how many messages each one of you have exchanged per **week** between the dates of **{start_date.strftime('%m/%y')}** and **{end_date.strftime('%m/%y')}**, the most messages you guys have exchanged in a week was **{extras[0]}** on **{extras[1].strftime('%d/%m/%y')}**",
+        default=True,
+    ),
+    Analysis(
+        'create_average_wpm_graph',
+        "How many words do your messages have?",
+        lambda extras, start_date, end_date: "This basically shows how much effort each person puts in each message, the more words per message, the more it feels like the person is putting in real effort",
+        columns=['Message Length', 'Media', 'Deleted'],
+    ),
+    Analysis(
+        'average_reply_time_graph',
+        "How long does it take for you to reply?",
+        lambda extras, start_date, end_date: "This is how long it usually took each person to reply to the previous message within a conversation, half of their replies took less than that, so one reply the next morning doesn't hide a week of quick ones",
+        columns=['Reply time'],
+    ),
+    Analysis(
+        'average_conversation_hour_graph',
+        "When do you talk the most?",
+        lambda extras, start_date, end_date: "This shows when during the day you guys talk the most! Change the slider dates to see how that has changed with time",
+        columns=['Hour'],
+    ),
+    Analysis(
+        'conversation_starter_graph',
+        "Who's starts the conversations?",
+        lambda extras, start_date, end_date: f"This clearly shows that **{extras[0]}** started all the convos",
+        columns=['Conv change'],
+        wide=False,
+    ),
+    Analysis(
+        'reply_time_aggregated_graph',
+        "Who takes the longest to reply?",
+        lambda extras, start_date, end_date: f"Who takes the longest to reply? Going by how long each one usually takes, **{extras[0]}** won this one",
+        columns=['Reply time'],
+        wide=False,
+    ),
+    Analysis(
+        'message_count_aggregated_graph',
+        "Who talks the most?",
+        lambda extras, start_date, end_date: f"How many messages has each one sent in your convo? apparently **{extras[0]}** did",
+        wide=False,
+        default=True,
+    ),
+    Analysis(
+        'message_size_aggregated_graph',
+        "Who sends the bigger messages?",
+        lambda extras, start_date, end_date: f"This one shows the average message length, apparently **{extras[0]}** puts the most effort for each message",
+        columns=['Message Length', 'Media', 'Deleted'],
+        wide=False,
+    ),
+    Analysis(
+        'conversation_size_aggregated_graph',
+        "How long are your conversations?",
+        lambda extras, start_date, end_date: "This is how many messages (on average) your conversations had, the more of them there are, the more messages you guys exchanged everytime one of you started the convo!",
+        columns=['Conv code'],
+    ),
+    Analysis(
+        'reply_heatmap_graph',
+        "Who replies to whom?",
+        lambda extras, start_date, end_date: f"Each square is how many times the person on the left replied to the person at the bottom within a conversation, **{extras[0]}** replying to **{extras[1]}** happened the most, **{extras[2]}** times" if extras[0] is not None else "Nobody replied to anybody in these dates",
+        columns=['Reply time', 'Previous subject'],
+    ),
+    Analysis(
+        'conversation_gap_graph',
+        "How long do you go without talking?",
+        lambda extras, start_date, end_date: f"How many hours the chat had been quiet when each of you started a new conversation, usually and in the 1 in 10 and 1 in 100 longest silences, **{extras[0]}** usually waits the longest, about **{extras[1]:.1f}** hours" if extras[0] is not None else "Nobody started a conversation in these dates",
+        columns=['Inter conv time'],
+    ),
+]
+
+
+def analyses_columns(analyses : list):
+    """Derived columns needed by any of the given analyses."""
+    return sorted({column for analysis in analyses for column in analysis.columns})
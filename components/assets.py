@@ -0,0 +1,67 @@
+import base64
+import os
+import threading
+
+from components.ui_components import download_button, load_lottieurl
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class AssetManager:
+    """
+    Static files the pages show, loaded, encoded and checked once per process and then
+    shared by every rerun and session instead of being read from disk each time.
+    Relative paths are resolved against the repository root so the working directory doesn't matter.
+    """
+    def __init__(self, root : str = ROOT):
+        self.root = root
+        self._assets = {}
+        self._lock = threading.Lock()
+
+    def lottie(self, url : str):
+        """Parsed lottie animation from a local file or a http url."""
+        def load():
+            animation = load_lottieurl(url if url.startswith('http') else self._path(url))
+            if not isinstance(animation, dict) or 'layers' not in animation:
+                raise ValueError(f'{url} is not a lottie animation')
+            return animation
+        return self._get(('lottie', url), load)
+
+    def svg_html(self, path : str):
+        """An img tag with the SVG inlined, ready for st.write(..., unsafe_allow_html=True)."""
+        def load():
+            svg = self.bytes(path)
+            if b'<svg' not in svg[:1024]:
+                raise ValueError(f'{path} is not an SVG image')
+            b64 = base64.b64encode(svg).decode('utf-8')
+            return f"""<img style = "width: 100%" src="data:image/svg+xml;base64,{b64}"/>"""
+        return self._get(('svg', path), load)
+
+    def bytes(self, path : str):
+        def load():
+            with open(self._path(path), 'rb') as file:
+                return file.read()
+        return self._get(('bytes', path), load)
+
+    def download_link(self, path : str, download_filename : str, button_text : str):
+        """Legacy HTML download link for Streamlit versions without st.download_button."""
+        return self._get(
+            ('download link', path, download_filename, button_text),
+            lambda: download_button(self.bytes(path).decode('utf-8'), download_filename, button_text)
+        )
+
+    def _path(self, path : str):
+        return path if os.path.isabs(path) else os.path.join(self.root, path)
+
+    def _get(self, key : tuple, load):
+        with self._lock:
+            if key in self._assets:
+                return self._assets[key]
+        # Loading happens outside the lock, two sessions racing on a cold asset just both load it once
+        asset = load()
+        with self._lock:
+            return self._assets.setdefault(key, asset)
+
+
+# Process-wide, shared by every Streamlit session
+assets = AssetManager()
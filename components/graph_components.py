@@ -1,6 +1,36 @@
 import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
+from components.analyses import CONVERSATION_GAP_QUANTILES, REPLY_HEATMAP_SIZE
+from processing.aggregates import ChatAggregates
+
+# Every graph method, in the order the app shows them
+GRAPHS = [
+    'create_messages_per_week_graph',
+    'create_average_wpm_graph',
+    'average_reply_time_graph',
+    'average_conversation_hour_graph',
+    'conversation_starter_graph',
+    'reply_time_aggregated_graph',
+    'message_count_aggregated_graph',
+    'message_size_aggregated_graph',
+    'conversation_size_aggregated_graph',
+    'reply_heatmap_graph',
+    'conversation_gap_graph',
+]
+
+
+def default_graph_params(subjects : list):
+    cmap = plt.get_cmap('viridis')
+    return {
+        'subjects' : subjects,
+        'wide_figsize' : (12, 5),
+        'narrow_figsize': (6, 5),
+        'cmap' : cmap,
+        'colors' : cmap(np.linspace(0, 1, len(subjects))),
+        'area_alpha' : 0.6,
+    }
+
 
 class GraphComponents:
     def __init__(self, params):
@@ -40,71 +70,104 @@ class GraphComponents:
         ax.set_ylabel('')
         return fig
 
-    def create_messages_per_week_graph(self, df : pd.DataFrame):
+    def create_messages_per_week_graph(self, aggregates : ChatAggregates):
         #Makes first graph
-        date_df = df.resample('W').sum()[self.params['subjects']]
+        date_df = aggregates.weekly('Messages', self.params['subjects'])
         fig = self._create_wide_area_fig(date_df)
 
         max_message_count = date_df[self.params['subjects']].sum(axis = 1).max()
         max_message_count_date = date_df.index[date_df[self.params['subjects']].sum(axis = 1).argmax()]
         return fig, max_message_count, max_message_count_date
 
-    def create_average_wpm_graph(self, df : pd.DataFrame):
-        other_y_columns = [f"{subject}_mlength" for subject in df['Subject'].unique()]
-        date_avg_df = df[other_y_columns].resample('W').mean()
+    def create_average_wpm_graph(self, aggregates : ChatAggregates):
+        date_avg_df = aggregates.weekly_average_words(aggregates.subjects)
         fig = self._create_wide_area_fig(date_avg_df)
         return fig
 
-    def average_reply_time_graph(self, df):
+    def average_reply_time_graph(self, aggregates : ChatAggregates):
         fig, ax = plt.subplots(figsize=self.params['wide_figsize'])
-        filtered_sender_changes = df[df['Is reply']]
+        # Medians rather than means, a single reply the next morning would outweigh a whole week of quick ones
+        weekly_df = aggregates.weekly_latency_quantile('Reply time', 0.5, self.params['subjects']).fillna(0)
         for index, subject in enumerate(self.params['subjects']):
-            subject_df = filtered_sender_changes[filtered_sender_changes['Subject'] == subject].resample('W').mean().fillna(0)['Reply time']
+            subject_df = weekly_df[subject]
             subject_df.plot(kind='line', alpha=0.95, cmap=self.params['cmap'], ax=ax, label=subject, color=self.params['colors'][index], marker='o',
                             markersize=5)
         ax.patch.set_alpha(0.0)
         return fig
 
-    def average_conversation_hour_graph(self, df):
-        hour_df = df.groupby('Hour').count()['Message'] / (df['Date'].values[-1] - df['Date'].values[0]).astype(
-            'timedelta64[D]').astype('int')
+    def average_conversation_hour_graph(self, aggregates : ChatAggregates):
+        hour_df = aggregates.by_hour('Messages') / (aggregates.end_date - aggregates.start_date).days
         fig = self._create_wide_area_fig(hour_df, legend = False)
         return fig
 
-    def conversation_starter_graph(self, df):
-        subject_df = df[df['Conv change']].groupby('Subject').count()['Reply time']
+    def conversation_starter_graph(self, aggregates : ChatAggregates):
+        subject_df = aggregates.by_subject('Conv starts')
+        subject_df = subject_df[subject_df > 0]
         fig = self.create_narrow_pie_fig(subject_df)
         most_messages_winner = subject_df.index[subject_df.argmax()]
         return fig,most_messages_winner
 
-    def reply_time_aggregated_graph(self, df):
-        avg_msg_length = df.groupby('Subject').mean()['Reply time']
+    def reply_time_aggregated_graph(self, aggregates : ChatAggregates):
+        avg_msg_length = aggregates.latency_quantiles('Reply time', [0.5])[0.5]
         fig = self._create_narrow_bar_fig(avg_msg_length, 0.05)
 
         most_wpm_winner = avg_msg_length.index[avg_msg_length.argmax()]
         return fig,most_wpm_winner
 
-    def message_count_aggregated_graph(self, df):
-        subject_df = df.groupby('Subject').count()['Message'].sort_values(ascending=False)
+    def message_count_aggregated_graph(self, aggregates : ChatAggregates):
+        subject_df = aggregates.by_subject('Messages').sort_values(ascending=False)
         most_messages_winner = subject_df.index[subject_df.argmax()]
         fig = self.create_narrow_pie_fig(subject_df)
         return fig, most_messages_winner
 
-    def message_size_aggregated_graph(self, df):
-        avg_msg_length = df.groupby('Subject').mean()['Message Length']
+    def message_size_aggregated_graph(self, aggregates : ChatAggregates):
+        avg_msg_length = aggregates.average_words().fillna(0)
 
         most_wpm_winner = avg_msg_length.index[avg_msg_length.argmax()]
         fig = self._create_narrow_bar_fig(avg_msg_length, 0.01)
         return fig, most_wpm_winner
 
-    def conversation_size_aggregated_graph(self, df):
-        conversations_df = df.groupby('Conv code').agg(count=('Conv code', 'size'),
-                                                       mean_date=('Date', 'mean')).reset_index()
+    def conversation_size_aggregated_graph(self, aggregates : ChatAggregates):
+        conversations_df = aggregates.conversation_sizes()
         conversations_df.index = conversations_df['mean_date']
-        conversations_df = conversations_df.resample('W').mean().fillna(0)
-        print(conversations_df.head(50))
+        conversations_df = conversations_df[['count']].resample('W').mean().fillna(0)
         fig, ax = plt.subplots(figsize=self.params['wide_figsize'])
         ax.plot(conversations_df.index, conversations_df['count'], color=self.params['colors'][0], alpha=0.7)
         ax.fill_between(x=conversations_df.index, y1=conversations_df['count'], color=self.params['colors'][0], alpha=0.5)
         ax.patch.set_alpha(0.0)
-        return fig
\ No newline at end of file
+        return fig
+
+    def reply_heatmap_graph(self, aggregates : ChatAggregates):
+        matrix = aggregates.reply_matrix('Replies', top=REPLY_HEATMAP_SIZE)
+        fig, ax = plt.subplots(figsize=self.params['wide_figsize'])
+        image = ax.imshow(matrix.values, cmap=self.params['cmap'], aspect='auto')
+        ax.set_xticks(range(len(matrix.columns)))
+        ax.set_xticklabels(matrix.columns, rotation=45, ha='right')
+        ax.set_yticks(range(len(matrix.index)))
+        ax.set_yticklabels(matrix.index)
+        ax.set_xlabel('Replying to')
+        ax.set_ylabel('Reply from')
+        ax.grid(False)
+        fig.colorbar(image, ax=ax)
+        fig.patch.set_alpha(0.0)
+
+        pairs = aggregates.reply_pairs()
+        if len(pairs) == 0:
+            return fig, None, None, 0
+        (replier, replied_to), top_pair = next(pairs.iterrows())
+        return fig, replier, replied_to, int(top_pair['Replies'])
+
+    def conversation_gap_graph(self, aggregates : ChatAggregates):
+        quantiles_df = aggregates.latency_quantiles('Inter conv time', list(CONVERSATION_GAP_QUANTILES)) / 60
+        quantiles_df = quantiles_df.rename(columns=CONVERSATION_GAP_QUANTILES)
+        fig, ax = plt.subplots(figsize=self.params['wide_figsize'])
+        ax.set_ylabel('Hours without messages')
+        ax.set_xlabel('')
+        ax.patch.set_alpha(0.0)
+        fig.patch.set_alpha(0.0)
+        # Date ranges without a conversation start, like a single day, have nothing to plot
+        if len(quantiles_df) == 0:
+            return fig, None, 0
+        quantiles_df.plot(kind='bar', cmap=self.params['cmap'], ax=ax, alpha=0.96)
+        typical = quantiles_df[CONVERSATION_GAP_QUANTILES[0.5]]
+        return fig, typical.idxmax(), typical.max()
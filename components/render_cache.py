@@ -0,0 +1,138 @@
+import io
+import multiprocessing
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from processing.executor import analysis_executor, AnalysisBusy
+
+# Same settings st.pyplot rasterises figures with
+SAVEFIG_KWARGS = {'format': 'png', 'dpi': 200, 'bbox_inches': 'tight'}
+# Every worker holds its own pandas and matplotlib plus a copy of the aggregates it renders, so the default
+# pool stays small, WHATSAPP_ANALYSER_RENDER_WORKERS sets it on hosts with the memory for more
+DEFAULT_RENDER_WORKERS = 2
+
+
+def render_graph(aggregates, subjects : list, graph : str):
+    """
+    Draws one GraphComponents graph and rasterises it to PNG bytes.
+    Returns (png, extras) where extras are whatever the graph method returned besides
+    its figure, such as the winner of an aggregated graph.
+    """
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    from components.graph_components import GraphComponents, default_graph_params
+
+    result = getattr(GraphComponents(default_graph_params(subjects)), graph)(aggregates)
+    fig, extras = (result[0], result[1:]) if isinstance(result, tuple) else (result, ())
+    buffer = io.BytesIO()
+    try:
+        fig.savefig(buffer, **SAVEFIG_KWARGS)
+    finally:
+        # pyplot keeps every figure alive until it is closed
+        plt.close(fig)
+    return buffer.getvalue(), extras
+
+
+def copy_outcome(source : Future, destination : Future):
+    if source.exception() is not None:
+        destination.set_exception(source.exception())
+    else:
+        destination.set_result(source.result())
+
+
+class FigureCache:
+    """
+    Rendered graphs keyed by chat hash, filter state and graph name, evicted least
+    recently used first once over either the entry or the byte limit.
+    Misses are rendered concurrently on a pool of worker processes, so a filter change
+    costs about as much as the slowest graph instead of the sum of all of them. Without
+    one they are rendered on the shared analysis_executor threads.
+    """
+    def __init__(self, max_entries : int = 64, max_bytes : int = 64 << 20, workers : int = None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        if workers is None:
+            # A single core gains nothing from a pool but the cost of shipping work to it
+            cpus = os.cpu_count() or 1
+            workers = min(DEFAULT_RENDER_WORKERS, cpus) if cpus > 1 else 0
+        self.workers = workers
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._pending = {}
+        self._executor = None
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(chat_hash : str, graph : str, start_date, end_date, subjects : list,
+                 inter_conversation_threshold_time : int = None):
+        return chat_hash, graph, str(start_date), str(end_date), tuple(subjects), inter_conversation_threshold_time
+
+    def submit(self, key : tuple, graph : str, aggregates, subjects : list):
+        """Returns a future resolving to (png, extras), already done when the graph was cached."""
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                future = Future()
+                future.set_result(self._entries[key])
+                return future
+            # Two reruns asking for the same graph share one render
+            if key in self._pending:
+                return self._pending[key]
+            future = Future()
+            self._pending[key] = future
+        future.add_done_callback(lambda done: self._store(key, done))
+        # Rendering happens outside the lock so queueing for a worker doesn't hold up other sessions
+        self._render(key, graph, aggregates, subjects).add_done_callback(lambda done: copy_outcome(done, future))
+        return future
+
+    def _render(self, key : tuple, graph : str, aggregates, subjects : list):
+        if self.workers > 0:
+            try:
+                return self._get_executor().submit(render_graph, aggregates, subjects, graph)
+            except BrokenProcessPool:
+                self._executor = None
+        # Renders on the shared analysis workers when pools are disabled or the pool died
+        try:
+            return analysis_executor.submit(('render',) + key, f'render {graph}', render_graph, aggregates, subjects,
+                                            graph).future
+        except AnalysisBusy as error:
+            future = Future()
+            future.set_exception(error)
+            return future
+
+    def _get_executor(self):
+        if self._executor is None:
+            # Forking a process that runs the Streamlit server's threads isn't safe, so workers are spawned
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context('spawn')
+            )
+        return self._executor
+
+    def _store(self, key : tuple, future : Future):
+        with self._lock:
+            self._pending.pop(key, None)
+            if future.cancelled() or future.exception() is not None:
+                # A worker dying, e.g. killed for running out of memory, breaks the whole pool, the next
+                # render starts a new one
+                if not future.cancelled() and isinstance(future.exception(), BrokenProcessPool):
+                    self._executor = None
+                return
+            png, extras = future.result()
+            self._entries[key] = (png, extras)
+            self._bytes += len(png)
+            while len(self._entries) > 1 and (len(self._entries) > self.max_entries or self._bytes > self.max_bytes):
+                _, (evicted_png, _) = self._entries.popitem(last=False)
+                self._bytes -= len(evicted_png)
+
+
+# Process-wide cache shared by every Streamlit session
+figure_cache = FigureCache(
+    max_entries=int(os.environ.get('WHATSAPP_ANALYSER_FIGURE_CACHE_ENTRIES', 64)),
+    max_bytes=int(os.environ.get('WHATSAPP_ANALYSER_FIGURE_CACHE_MB', 64)) << 20,
+    workers=int(os.environ['WHATSAPP_ANALYSER_RENDER_WORKERS']) if 'WHATSAPP_ANALYSER_RENDER_WORKERS' in os.environ else None,
+)
@@ -1,13 +1,14 @@
 import base64
 import json
 
-import requests
 import uuid
 import re
 
 
 def load_lottieurl(url: str):
     if url.startswith('http'):
+        # Only remote animations need requests, so it isn't imported at startup
+        import requests
         r = requests.get(url)
         if r.status_code != 200:
             return None
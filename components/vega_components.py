@@ -0,0 +1,241 @@
+import pandas as pd
+
+from components.analyses import CONVERSATION_GAP_QUANTILES, REPLY_HEATMAP_SIZE
+from processing.aggregates import ChatAggregates
+
+# Decimals kept in the data sent to the browser, more would only make the payload bigger
+VALUE_DECIMALS = 3
+WIDE_HEIGHT = 300
+NARROW_HEIGHT = 300
+# Dragging pans and scrolling zooms the time axis in the browser, without asking the server for anything
+ZOOM_SELECTION = {'zoom': {'type': 'interval', 'bind': 'scales', 'encodings': ['x']}}
+
+
+def records(df : pd.DataFrame):
+    """df as Vega-Lite inline data values, dates as ISO strings and floats rounded to VALUE_DECIMALS."""
+    df = df.copy()
+    for column in df.columns:
+        if pd.api.types.is_datetime64_any_dtype(df[column]):
+            df[column] = df[column].dt.strftime('%Y-%m-%d')
+        elif pd.api.types.is_float_dtype(df[column]):
+            df[column] = df[column].round(VALUE_DECIMALS)
+        elif isinstance(df[column].dtype, pd.CategoricalDtype):
+            df[column] = df[column].astype(str)
+    # NaN isn't valid JSON, Vega-Lite leaves nulls out of the chart instead
+    return df.astype(object).where(df.notna(), None).to_dict(orient='records')
+
+
+def field_name(name):
+    """A column name as a Vega-Lite field, whose dots and brackets would otherwise reach into nested data."""
+    name = str(name)
+    for character in '\\.[]':
+        name = name.replace(character, '\\' + character)
+    return name
+
+
+def weekly_data(weekly_df : pd.DataFrame, value : str):
+    """
+    Data and transform for a weekly frame with one column per subject. It is sent as is, one record
+    per week, and folded into one record per week and subject by the browser, which keeps the week
+    and field names from being repeated for every subject.
+    """
+    weekly_df = weekly_df.rename(columns=str).rename_axis(index='Week', columns=None).reset_index()
+    subjects = [column for column in weekly_df.columns if column != 'Week']
+    return {'values': records(weekly_df)}, [{'fold': [field_name(subject) for subject in subjects],
+                                             'as': ['Subject', value]}]
+
+
+class VegaComponents:
+    """
+    The GraphComponents graphs as Vega-Lite specs the browser draws, returning the same extras.
+    Each spec carries its data inline, taken from the aggregates, so its size depends on the weeks,
+    hours and subjects shown and not on how many messages the chat has, and hovering, panning and
+    zooming happen in the browser.
+    """
+    def __init__(self, params):
+        self.params = params
+
+    def _color(self, field : str = 'Subject', legend : bool = True):
+        color = {
+            'field': field,
+            'type': 'nominal',
+            'scale': {'domain': [str(subject) for subject in self.params['subjects']], 'scheme': 'viridis'},
+        }
+        if not legend:
+            color['legend'] = None
+        return color
+
+    def _wide_area_spec(self, weekly_df : pd.DataFrame, value : str):
+        data, transform = weekly_data(weekly_df, value)
+        return {
+            'data': data,
+            'transform': transform,
+            'mark': {'type': 'area', 'opacity': 0.6},
+            'height': WIDE_HEIGHT,
+            'selection': ZOOM_SELECTION,
+            'encoding': {
+                'x': {'field': 'Week', 'type': 'temporal', 'title': None},
+                'y': {'field': value, 'type': 'quantitative', 'stack': 'zero'},
+                'color': self._color(),
+                'tooltip': [
+                    {'field': 'Week', 'type': 'temporal'},
+                    {'field': 'Subject', 'type': 'nominal'},
+                    {'field': value, 'type': 'quantitative'},
+                ],
+            },
+        }
+
+    def _narrow_bar_spec(self, subject_df : pd.Series, value : str):
+        return {
+            'data': {'values': records(subject_df.rename(value).rename_axis('Subject').reset_index())},
+            'mark': 'bar',
+            'height': NARROW_HEIGHT,
+            'encoding': {
+                'x': {'field': 'Subject', 'type': 'nominal', 'title': None, 'sort': None},
+                'y': {'field': value, 'type': 'quantitative'},
+                'color': self._color(legend=False),
+                'tooltip': [{'field': 'Subject', 'type': 'nominal'}, {'field': value, 'type': 'quantitative'}],
+            },
+        }
+
+    def _narrow_donut_spec(self, subject_df : pd.Series, value : str):
+        return {
+            'data': {'values': records(subject_df.rename(value).rename_axis('Subject').reset_index())},
+            'mark': {'type': 'arc', 'innerRadius': 80},
+            'height': NARROW_HEIGHT,
+            'view': {'stroke': None},
+            'encoding': {
+                'theta': {'field': value, 'type': 'quantitative'},
+                'color': self._color(),
+                'tooltip': [{'field': 'Subject', 'type': 'nominal'}, {'field': value, 'type': 'quantitative'}],
+            },
+        }
+
+    def create_messages_per_week_graph(self, aggregates : ChatAggregates):
+        date_df = aggregates.weekly('Messages', self.params['subjects'])
+        spec = self._wide_area_spec(date_df, 'Messages')
+
+        max_message_count = date_df[self.params['subjects']].sum(axis = 1).max()
+        max_message_count_date = date_df.index[date_df[self.params['subjects']].sum(axis = 1).argmax()]
+        return spec, max_message_count, max_message_count_date
+
+    def create_average_wpm_graph(self, aggregates : ChatAggregates):
+        date_avg_df = aggregates.weekly_average_words(self.params['subjects'])
+        return self._wide_area_spec(date_avg_df, 'Words per message')
+
+    def average_reply_time_graph(self, aggregates : ChatAggregates):
+        weekly_df = aggregates.weekly_latency_quantile('Reply time', 0.5, self.params['subjects']).fillna(0)
+        spec = self._wide_area_spec(weekly_df, 'Median reply minutes')
+        spec['mark'] = {'type': 'line', 'point': True}
+        spec['encoding']['y'].pop('stack')
+        return spec
+
+    def average_conversation_hour_graph(self, aggregates : ChatAggregates):
+        hour_df = aggregates.by_hour('Messages') / (aggregates.end_date - aggregates.start_date).days
+        return {
+            'data': {'values': records(hour_df.rename('Messages per day').rename_axis('Hour').reset_index())},
+            'mark': {'type': 'area', 'opacity': 0.6},
+            'height': WIDE_HEIGHT,
+            'encoding': {
+                'x': {'field': 'Hour', 'type': 'ordinal'},
+                'y': {'field': 'Messages per day', 'type': 'quantitative'},
+                'tooltip': [{'field': 'Hour', 'type': 'ordinal'},
+                            {'field': 'Messages per day', 'type': 'quantitative'}],
+            },
+        }
+
+    def conversation_starter_graph(self, aggregates : ChatAggregates):
+        subject_df = aggregates.by_subject('Conv starts')
+        subject_df = subject_df[subject_df > 0]
+        spec = self._narrow_donut_spec(subject_df, 'Conversations started')
+        most_messages_winner = subject_df.index[subject_df.argmax()]
+        return spec, most_messages_winner
+
+    def reply_time_aggregated_graph(self, aggregates : ChatAggregates):
+        median_reply_time = aggregates.latency_quantiles('Reply time', [0.5])[0.5]
+        spec = self._narrow_bar_spec(median_reply_time, 'Median reply minutes')
+        return spec, median_reply_time.index[median_reply_time.argmax()]
+
+    def message_count_aggregated_graph(self, aggregates : ChatAggregates):
+        subject_df = aggregates.by_subject('Messages').sort_values(ascending=False)
+        most_messages_winner = subject_df.index[subject_df.argmax()]
+        return self._narrow_donut_spec(subject_df, 'Messages'), most_messages_winner
+
+    def message_size_aggregated_graph(self, aggregates : ChatAggregates):
+        avg_msg_length = aggregates.average_words().fillna(0)
+        spec = self._narrow_bar_spec(avg_msg_length, 'Words per message')
+        return spec, avg_msg_length.index[avg_msg_length.argmax()]
+
+    def conversation_size_aggregated_graph(self, aggregates : ChatAggregates):
+        conversations_df = aggregates.conversation_sizes()
+        conversations_df.index = conversations_df['mean_date']
+        conversations_df = conversations_df[['count']].resample('W').mean().fillna(0)
+        return {
+            'data': {'values': records(conversations_df.rename(columns={'count': 'Messages per conversation'})
+                                       .rename_axis('Week').reset_index())},
+            'mark': {'type': 'area', 'opacity': 0.6, 'line': True},
+            'height': WIDE_HEIGHT,
+            'selection': ZOOM_SELECTION,
+            'encoding': {
+                'x': {'field': 'Week', 'type': 'temporal', 'title': None},
+                'y': {'field': 'Messages per conversation', 'type': 'quantitative'},
+                'tooltip': [{'field': 'Week', 'type': 'temporal'},
+                            {'field': 'Messages per conversation', 'type': 'quantitative'}],
+            },
+        }
+
+    def reply_heatmap_graph(self, aggregates : ChatAggregates):
+        matrix = aggregates.reply_matrix('Replies', top=REPLY_HEATMAP_SIZE)
+        cells = matrix.rename_axis(index='Reply from', columns='Replying to').stack().rename('Replies').reset_index()
+        subjects = [str(subject) for subject in matrix.index]
+        spec = {
+            'data': {'values': records(cells)},
+            'mark': 'rect',
+            'height': WIDE_HEIGHT,
+            'encoding': {
+                'x': {'field': 'Replying to', 'type': 'nominal', 'sort': subjects},
+                'y': {'field': 'Reply from', 'type': 'nominal', 'sort': subjects},
+                'color': {'field': 'Replies', 'type': 'quantitative', 'scale': {'scheme': 'viridis'}},
+                'tooltip': [{'field': 'Reply from', 'type': 'nominal'}, {'field': 'Replying to', 'type': 'nominal'},
+                            {'field': 'Replies', 'type': 'quantitative'}],
+            },
+        }
+
+        pairs = aggregates.reply_pairs()
+        if len(pairs) == 0:
+            return spec, None, None, 0
+        (replier, replied_to), top_pair = next(pairs.iterrows())
+        return spec, replier, replied_to, int(top_pair['Replies'])
+
+    def conversation_gap_graph(self, aggregates : ChatAggregates):
+        quantiles_df = aggregates.latency_quantiles('Inter conv time', list(CONVERSATION_GAP_QUANTILES)) / 60
+        quantiles_df = quantiles_df.rename(columns=CONVERSATION_GAP_QUANTILES)
+        bars = quantiles_df.rename_axis(index='Subject', columns='How often').stack().rename('Hours without messages')
+        spec = {
+            'data': {'values': records(bars.reset_index())},
+            'mark': 'bar',
+            'height': WIDE_HEIGHT,
+            'encoding': {
+                'column': {'field': 'Subject', 'type': 'nominal', 'title': None},
+                'x': {'field': 'How often', 'type': 'nominal', 'title': None,
+                      'sort': list(CONVERSATION_GAP_QUANTILES.values())},
+                'y': {'field': 'Hours without messages', 'type': 'quantitative'},
+                'color': {'field': 'How often', 'type': 'nominal', 'scale': {'scheme': 'viridis'},
+                          'sort': list(CONVERSATION_GAP_QUANTILES.values())},
+                'tooltip': [{'field': 'Subject', 'type': 'nominal'}, {'field': 'How often', 'type': 'nominal'},
+                            {'field': 'Hours without messages', 'type': 'quantitative'}],
+            },
+        }
+        if len(quantiles_df) == 0:
+            return spec, None, 0
+        typical = quantiles_df[CONVERSATION_GAP_QUANTILES[0.5]]
+        return spec, typical.idxmax(), typical.max()
+
+
+def chart_spec(aggregates, subjects : list, graph : str):
+    """
+    Builds one VegaComponents chart, the counterpart of render_cache.render_graph.
+    Returns (spec, extras) where extras are whatever the graph method returned besides its spec.
+    """
+    result = getattr(VegaComponents({'subjects': subjects}), graph)(aggregates)
+    return (result[0], result[1:]) if isinstance(result, tuple) else (result, ())
@@ -1,13 +1,25 @@
+import io
+import logging
+from concurrent.futures import Future, as_completed
+import pandas as pd
 import streamlit as st
 from streamlit_lottie import st_lottie
-import matplotlib.pyplot as plt
-import matplotlib.pylab as pl
-import numpy as np
-from components.graph_components import GraphComponents
-from components.ui_components import download_button
-from components.ui_components import load_lottieurl
-from data_utils import get_df_from_data
-import base64
+from components.analyses import ANALYSES, analyses_columns
+from components.assets import assets
+from components.render_cache import figure_cache
+from components.vega_components import chart_spec
+from data_utils import (aggregates_columns, aggregates_key, ChatParseError, get_aggregates_from_data,
+                        get_preview_aggregates, get_sessions, hash_upload, peek_aggregates, peek_df, peek_sessions,
+                        peek_unparsed_messages)
+from instrumentation import progress_callback, span, start_trace
+from processing.compact import memory_report
+from processing.executor import analysis_executor, AnalysisBusy
+from processing.sessions import SESSION_COLUMNS
+
+BUSY_WARNING = "Lots of chats are being analysed right now, try again in a few seconds"
+RENDER_ERROR = "Something went wrong drawing this graph, try reloading the page"
+
+logger = logging.getLogger(__name__)
 
 class ViewController:
     def __init__(self):
@@ -20,9 +32,10 @@ class ViewController:
 
         )
 
-        self.lottie_chat = load_lottieurl('animations_data/phone_chat.json')
-        self.lottie_message = load_lottieurl('animations_data/message_lottie.json')
-        self.lottie_data = load_lottieurl('animations_data/data_charts.json')
+        # Loaded once per process, every rerun after the first gets them from memory
+        self.lottie_chat = assets.lottie('animations_data/phone_chat.json')
+        self.lottie_message = assets.lottie('animations_data/message_lottie.json')
+        self.lottie_data = assets.lottie('animations_data/data_charts.json')
         self.github_link = 'https://github.com/akiragondo/whatsapp_analyser'
         self.file_path = 'sample_whatsapp_export.txt'
 
@@ -32,103 +45,114 @@ class ViewController:
         c1.title("""Whatsapp Chat Analyser""")
         c1.subheader("""Discover trends, analyse your chat history and judge your friends!""")
         c1.markdown(f"Dont worry, we wont peek, we're not about that, in fact, you can check the code in here: [link]({self.github_link})")
-        uploaded_file = c1.file_uploader(label="""Upload your Whatsapp chat, don't worry, we won't peek""")
+        uploaded_file = c1.file_uploader(label="""Upload your Whatsapp chat, the .txt or the whole .zip export, don't worry, we won't peek""")
 
-        with open(self.file_path, 'r') as f:
-            dl_button = download_button(f.read(), 'sample_file.txt', 'Try it out with my sample file!')
-            c1.markdown(dl_button, unsafe_allow_html=True)
+        if hasattr(st, 'download_button'):
+            # The file is only sent when the button is clicked instead of being inlined into every rerun's page
+            c1.download_button('Try it out with my sample file!', assets.bytes(self.file_path),
+                               file_name='sample_file.txt', mime='text/plain')
+        else:
+            c1.markdown(assets.download_link(self.file_path, 'sample_file.txt', 'Try it out with my sample file!'),
+                        unsafe_allow_html=True)
 
         with c2:
             st_lottie(self.lottie_chat, speed=1, height=400, key="msg_lottie")
+        selected_titles = c1.multiselect(
+            "Which insights would you like to see? Only the ones you pick are calculated, so the fewer you pick, the faster it gets",
+            [analysis.title for analysis in ANALYSES],
+            default=[analysis.title for analysis in ANALYSES if analysis.default])
+        selected_analyses = [analysis for analysis in ANALYSES if analysis.title in selected_titles]
+        threshold = c1.slider(
+            "How many minutes without messages end a conversation?",
+            min_value=5, max_value=360, value=60, step=5)
+
+        chat_hash = self.upload_hash(uploaded_file) if uploaded_file is not None else None
         if uploaded_file is not None:
-            df = get_df_from_data(uploaded_file)
-
+            # Analyses run on the shared workers and may outlive this rerun, so they read their own view of the
+            # upload, which shares its bytes instead of copying them
+            uploaded_file = io.BytesIO(uploaded_file.getvalue())
+        columns = analyses_columns(selected_analyses)
+        if uploaded_file is not None:
+            # Remembered for the performance panel, which shows how much memory this chat takes
+            self.loaded_chat = (chat_hash, threshold, columns)
+        # Analyses that don't depend on the threshold only need the parse and cheap per message columns, so
+        # they are shown before the conversations are worked out. Those aggregates get every column but the
+        # session ones, which leaves only the session columns to add to the same cached frame afterwards
+        needs_sessions = any(analysis.uses_threshold for analysis in selected_analyses)
+        early_columns = columns
+        if needs_sessions:
+            early_columns = [column for column in aggregates_columns(columns) if column not in SESSION_COLUMNS]
+        aggregates = early = preview = None
+        if uploaded_file is not None:
+            aggregates = peek_aggregates(chat_hash, threshold, columns)
+            if aggregates is None:
+                early = peek_aggregates(chat_hash, threshold, early_columns)
+            if aggregates is None and early is None and self.fast_preview:
+                preview = self.analyse(c1, ('preview', chat_hash, threshold, tuple(columns)), 'preview aggregates',
+                                       get_preview_aggregates, uploaded_file, threshold, chat_hash, columns)
+            if aggregates is None and early is None and preview is None:
+                early = self.load_aggregates(c1, uploaded_file, threshold, chat_hash, early_columns)
+            if early is not None and not needs_sessions:
+                aggregates, early = early, None
+        # Big uploads show graphs estimated from a sample first, the widgets are built from whatever came first
+        shown = next((candidate for candidate in (aggregates, early, preview) if candidate is not None), None)
+        if shown is not None:
+            conversation_count_line = c1.empty()
             st.subheader('Date Range')
 
             format = 'MMM, YYYY'  # format output
-            start_date = df.index.to_pydatetime()[0]
-            end_date = df.index.to_pydatetime()[-1]
+            start_date = shown.start_date.to_pydatetime()
+            end_date = shown.end_date.to_pydatetime()
 
             slider = st.slider('Select date', min_value=start_date, value=(start_date, end_date), max_value=end_date, format=format)
 
-            df = df[slider[0]:slider[1]]
-            all_subjects = [subject for subject in df['Subject'].unique()]
+            with span('filter dates'):
+                date_filtered = shown.filter(slider[0], slider[1])
+            all_subjects = date_filtered.subjects
 
             y_columns = st.multiselect(
                 "Select and deselect the people you would like to include in the analysis. You can clear the current selection by clicking the corresponding x-button on the right",
                 all_subjects, default=all_subjects)
-            subject_filter = [subject in y_columns for subject in df['Subject'].values]
-            df = df[subject_filter]
-
-
-            cmap = plt.get_cmap('viridis')
-            colors = pl.get_cmap('viridis')(np.linspace(0,1, len(y_columns)))
-            wide_figsize = (12, 5)
-            narrow_figsize = (6, 5)
-            params = {
-                'subjects' : y_columns,
-                'wide_figsize' : wide_figsize,
-                'narrow_figsize': narrow_figsize,
-                'cmap' : cmap,
-                'colors' : colors,
-                'area_alpha' : 0.6,
-            }
-            graphs = GraphComponents(params)
-            if len(y_columns) > 0:
-                fig, max_message_count, max_message_count_date = graphs.create_messages_per_week_graph(df)
-                st.subheader("When did you talk the most?")
-                st.markdown(f"This is how many messages each one of you have exchanged per **week** between the dates of **{slider[0].strftime('%m/%y')}** and **{slider[1].strftime('%m/%y')}**, the most messages you guys have exchanged in a week was **{max_message_count}** on **{max_message_count_date.strftime('%d/%m/%y')}**")
-                st.pyplot(fig)
-
-                fig = graphs.create_average_wpm_graph(df)
-                st.subheader("How many words do your messages have?")
-                st.markdown(f"This basically shows how much effort each person puts in each message, the more words per message, the more it feels like the person is putting in real effort")
-                st.pyplot(fig)
-
-
-                #Makes second graph
-                fig = graphs.average_reply_time_graph(df)
-                st.subheader("How long does it take for you to reply?")
-                st.markdown(f"This how long it took, on average for each person to reply to the previous message within a conversation")
-                st.pyplot(fig)
-
-                #Makes second graph
-                fig = graphs.average_conversation_hour_graph(df)
-                st.subheader("When do you talk the most?")
-                st.markdown(f"This shows when during the day you guys talk the most! Change the slider dates to see how that has changed with time")
-                st.pyplot(fig)
-
-                #Makes graph row
-                c_11,c_12 = st.columns((1,1))
-                fig1, most_messages_winner = graphs.conversation_starter_graph(df)
-                c_11.subheader("Who's starts the conversations?")
-                c_11.markdown(f"This clearly shows that **{most_messages_winner}** started all the convos")
-                c_11.pyplot(fig1)
 
+            if preview is None:
+                self.show_unparsed_messages(c1, chat_hash)
+                self.show_conversation_count(conversation_count_line, uploaded_file, chat_hash, threshold)
 
-                fig, most_wpm_winner = graphs.reply_time_aggregated_graph(df)
-                c_12.subheader("Who takes the longest to reply?")
-                c_12.markdown(f"Who takes the longest to reply? **{most_wpm_winner}** won this one")
-                c_12.pyplot(fig)
-
-
-                #Makes graph row
-                c_11,c_12 = st.columns((1,1))
-                fig1, most_messages_winner = graphs.message_count_aggregated_graph(df)
-                c_11.subheader("Who talks the most?")
-                c_11.markdown(f"How many messages has each one sent in your convo? apparently **{most_messages_winner}** did")
-                c_11.pyplot(fig1)
-
-                fig, most_wpm_winner = graphs.message_size_aggregated_graph(df)
-                c_12.subheader("Who sends the bigger messages?")
-                c_12.markdown(f"This one shows the average message length, apparently **{most_wpm_winner}** puts the most effort for each message")
-                c_12.pyplot(fig)
-
-
-                fig = graphs.conversation_size_aggregated_graph(df)
-                st.subheader("How long are your conversations?")
-                st.markdown(f"This is how many messages (on average) your conversations had, the more of them there are, the more messages you guys exchanged everytime one of you started the convo!")
-                st.pyplot(fig)
+            if len(y_columns) > 0:
+                sections = self.layout_sections(selected_analyses)
+                notice = None
+                status = c1
+                if preview is not None:
+                    notice = st.empty()
+                    status = notice.container()
+                    status.info("This is a big chat, so these graphs were estimated from a sample of it while "
+                                "the rest is read, they'll be replaced with the exact ones in a moment")
+                    figures = self.submit_sections(sections, f'{chat_hash} preview', preview, slider, y_columns,
+                                                   threshold)
+                    # Read in the background while the estimated graphs are drawn
+                    job = self.submit_aggregates(status, uploaded_file, threshold, chat_hash, early_columns)
+                    self.fill_sections(figures, slider)
+                    early = self.wait_aggregates(status, job)
+                    if early is not None and not needs_sessions:
+                        aggregates, early = early, None
+                    if early is not None or aggregates is not None:
+                        self.show_unparsed_messages(status, chat_hash)
+                        self.show_conversation_count(conversation_count_line, uploaded_file, chat_hash, threshold)
+                pending = sections
+                if early is not None:
+                    # The parse is cached by now, so working out the conversations only costs the session columns
+                    # and runs in the background while the graphs that don't need them are drawn
+                    figures = self.submit_sections([section for section in sections if not section[0].uses_threshold],
+                                                   chat_hash, early, slider, y_columns, threshold)
+                    # Queued after the early graphs so a busy pool still draws them first
+                    job = self.submit_aggregates(status, uploaded_file, threshold, chat_hash, columns)
+                    pending = [section for section in sections if section[0].uses_threshold]
+                    self.fill_sections(figures, slider)
+                    aggregates = self.wait_aggregates(status, job)
+                if aggregates is not None:
+                    if notice is not None:
+                        notice.empty()
+                    self.render_sections(pending, chat_hash, aggregates, slider, y_columns, threshold)
 
         thanks_line = """Special thanks to Charly Wargnier and Timon Schmelzer for the suggestions and jrieke for making the custom CSS download button!"""
         st.markdown("""    <style>
@@ -145,6 +169,152 @@ class ViewController:
             top: 2px;
         }</style>""", unsafe_allow_html=True)
 
+    def upload_hash(self, uploaded_file):
+        """Hashes an upload once per session, reruns for every slider move reuse it until another file is uploaded."""
+        upload_id = getattr(uploaded_file, 'id', None)
+        if upload_id is None:
+            return hash_upload(uploaded_file)
+        hashed_id, chat_hash = st.session_state.get('upload_hash', (None, None))
+        if hashed_id != upload_id:
+            chat_hash = hash_upload(uploaded_file)
+            st.session_state['upload_hash'] = (upload_id, chat_hash)
+        return chat_hash
+
+    def load_aggregates(self, container, uploaded_file, threshold, chat_hash, columns):
+        """Processes the whole upload, showing how far along reading it is in a progress bar in container."""
+        return self.wait_aggregates(container, self.submit_aggregates(container, uploaded_file, threshold, chat_hash,
+                                                                      columns))
+
+    def submit_aggregates(self, container, uploaded_file, threshold, chat_hash, columns):
+        return self.submit(container, aggregates_key(chat_hash, threshold, aggregates_columns(columns)),
+                           'load aggregates', get_aggregates_from_data, uploaded_file, threshold, chat_hash=chat_hash,
+                           columns=columns)
+
+    def wait_aggregates(self, container, job):
+        if job is None:
+            return None
+        with span('wait for aggregates'):
+            progress_bar = container.progress(0.0)
+            try:
+                with progress_callback(progress_bar.progress):
+                    aggregates = analysis_executor.wait(job)
+            except ChatParseError as error:
+                container.error(str(error))
+                aggregates = None
+            progress_bar.empty()
+        return aggregates
+
+    def show_unparsed_messages(self, container, chat_hash):
+        # Counted while parsing on a worker, which can't warn about it itself
+        unparsed = peek_unparsed_messages(chat_hash)
+        if unparsed > 0:
+            container.warning(f"{unparsed} messages have dates we couldn't read, so they were left out")
+
+    def show_conversation_count(self, line, uploaded_file, chat_hash, threshold):
+        # Counted straight from the sorted gaps, so it follows the slider without touching the messages
+        sessions = peek_sessions(chat_hash)
+        if sessions is None:
+            sessions = self.analyse(line, ('sessions', chat_hash), 'index sessions', get_sessions, uploaded_file,
+                                    chat_hash)
+        if sessions is not None:
+            with span('count conversations'):
+                conversation_count = sessions.conversation_count(threshold)
+            line.markdown(f"With that, your chat has **{conversation_count}** conversations")
+
+    def submit(self, container, key, name, function, *args, **kwargs):
+        """
+        Starts function on the shared analysis workers, joining any session already running it for the same key.
+        Returns its AnalysisJob, or None after warning in container when too many analyses are already waiting.
+        """
+        try:
+            return analysis_executor.submit(key, name, function, *args, **kwargs)
+        except AnalysisBusy:
+            container.warning(BUSY_WARNING)
+            return None
+
+    def analyse(self, container, key, name, function, *args, **kwargs):
+        """Runs function like submit does and waits for its result, None when it couldn't be queued or parsed."""
+        with span(f'wait for {name}'):
+            job = self.submit(container, key, name, function, *args, **kwargs)
+            if job is None:
+                return None
+            try:
+                return analysis_executor.wait(job)
+            except ChatParseError as error:
+                # Parsing ran on a worker thread, which can't show anything itself
+                container.error(str(error))
+                return None
+
+    def layout_sections(self, analyses):
+        """Lays out a placeholder for every analysis, wide ones full width and narrow ones in pairs."""
+        sections = []
+        free_column = None
+        for analysis in analyses:
+            if analysis.wide:
+                container, free_column = st, None
+            elif free_column is None:
+                #Makes graph row
+                container, free_column = st.columns((1,1))
+            else:
+                container, free_column = free_column, None
+            placeholder = container.empty()
+            placeholder.caption(f'Working on "{analysis.title}"...')
+            sections.append((analysis, placeholder))
+        return sections
+
+    def render_sections(self, sections, figures_key, aggregates, slider, y_columns, threshold):
+        self.fill_sections(self.submit_sections(sections, figures_key, aggregates, slider, y_columns, threshold), slider)
+
+    def submit_sections(self, sections, figures_key, aggregates, slider, y_columns, threshold):
+        """Starts rendering the graphs of the given sections, returns their futures mapped to the sections."""
+        if len(sections) == 0:
+            return {}
+        with span('filter subjects') as record:
+            filtered = aggregates.filter(slider[0], slider[1], y_columns)
+            record['rows'] = len(filtered.cube)
+        if self.interactive_charts:
+            # A spec is a few kilobytes of aggregates, quicker to build right here than to queue for a worker
+            figures = {}
+            with span('build charts', rows=len(sections)):
+                for analysis, placeholder in sections:
+                    figure = Future()
+                    figure.set_result(chart_spec(filtered, y_columns, analysis.graph))
+                    figures[figure] = (analysis, placeholder)
+            return figures
+        # Every open section is submitted up front so the graphs that aren't cached render in parallel
+        figures = {
+            figure_cache.submit(
+                figure_cache.make_key(figures_key, analysis.graph, slider[0], slider[1], y_columns,
+                                      threshold if analysis.uses_threshold else None),
+                analysis.graph, filtered, y_columns
+            ): (analysis, placeholder)
+            for analysis, placeholder in sections
+        }
+        return figures
+
+    def fill_sections(self, figures, slider):
+        # Each placeholder is filled as soon as its graph is ready rather than in page order
+        for figure in as_completed(figures):
+            analysis, placeholder = figures[figure]
+            with span(analysis.title):
+                try:
+                    chart, extras = figure.result()
+                except AnalysisBusy:
+                    placeholder.warning(BUSY_WARNING)
+                    continue
+                except Exception:
+                    # One graph failing, like its render worker dying, leaves the rest of the page standing
+                    logger.exception(f'Rendering {analysis.title} failed')
+                    placeholder.error(RENDER_ERROR)
+                    continue
+                section = placeholder.container()
+                section.subheader(analysis.title)
+                section.markdown(analysis.describe(extras, slider[0], slider[1]))
+                if isinstance(chart, dict):
+                    section.vega_lite_chart(spec=chart, use_container_width=True)
+                else:
+                    section.image(chart, use_column_width=True)
+
     def build_about_me_ui(self):
         st.title("About the Creator")
         c1, c2 = st.columns([1,1])
@@ -172,8 +342,7 @@ class ViewController:
         st.markdown("""To implement that in our messages, I have implemented a code that, if it detects a significant 
         amount of time between two messages, say around 1 hour, it'll define the end of a conversation and the 
         beginning of a new one! Here's the code for it:""")
-        image = open('images/ConvDiagram.svg', 'r').read()
-        self.render_svg(image)
+        self.render_svg('images/ConvDiagram.svg')
         st.code("""def cluster_into_conversations(
         df : pd.DataFrame, 
         inter_conversation_threshold_time: int = 60
@@ -181,24 +350,14 @@ class ViewController:
     threshold_time_mins = np.timedelta64(inter_conversation_threshold_time, 'm')
 
     # This calculates the time between the current message and the previous one
-    conv_delta = df.index.values - np.roll(df.index.values, 1)
-    conv_delta[0] = 0
+    conv_delta = message_time_deltas(df)
 
     # This detects where the time between messages is higher than the threshold
     conv_changes = conv_delta > threshold_time_mins
-    conv_changes_indices = np.where(conv_changes)[0]
-    conv_codes = []
 
-    # This encodes each message with its own conversation code
-    last_conv_change = 0
-    for i, conv_change in enumerate(conv_changes_indices):
-        conv_codes.extend([i]*(conv_change - last_conv_change))
-        last_conv_change = conv_change
-
-    # This serves to ensure that the conversation codes 
-    # and the number of messages are aligned
-    conv_codes = pad_list_to_value(conv_codes, len(df), conv_codes[-1])
-    conv_changes = pad_list_to_value(conv_changes, len(df), False)
+    # This encodes each message with its own conversation code, 
+    # which goes up by one on every change
+    conv_codes = np.cumsum(conv_changes)
 
     return conv_codes, conv_changes
         """)
@@ -209,18 +368,17 @@ class ViewController:
         The response of one person to the messages sent by the previous one within a conversation""")
         st.markdown("""This is faily easy to implement, I will say that a reply happens when the subject changes 
         within a conversation, here's the code for it!:""")
-        image = open('images/ReplyDiagram.svg', 'r').read()
-        self.render_svg(image)
+        self.render_svg('images/ReplyDiagram.svg')
         st.code("""def find_replies(df : pd.DataFrame):
     # These are sanity checks in order to see if I made any ordering mistakes
     assert('Conv code' in df.columns)
     assert('Conv change' in df.columns)
     assert('Subject' in df.columns)
-    # Ordinal encoders will encode each subject with its own number
-    message_senders = OrdinalEncoder().fit_transform(df['Subject'].values.reshape(-1,1))
+    # Factorizing encodes each subject with its own number
+    message_senders, _ = pd.factorize(df['Subject'])
     # This compares the current subject with the previous subject 
     # In a way that computers can optimize
-    sender_changed = (np.roll(message_senders, 1) - message_senders).reshape(1, -1)[0] != 0
+    sender_changed = np.roll(message_senders, 1) != message_senders
     sender_changed[0] = False
     # This checks if the reply isn't within a different conversation
     is_reply = sender_changed & ~df['Conv change']
@@ -230,11 +388,9 @@ class ViewController:
         conversation, say, when you two are really **Talking** to each other, which I think is more indicative of the 
         level of interaction you two are having""")
 
-    def render_svg(self, svg):
-        """Renders the given svg string."""
-        b64 = base64.b64encode(svg.encode('utf-8')).decode("utf-8")
-        html = f"""<img style = "width: 100%" src="data:image/svg+xml;base64,{b64}"/>"""
-        st.write(html, unsafe_allow_html=True)
+    def render_svg(self, path):
+        """Renders the svg file at the given path."""
+        st.write(assets.svg_html(path), unsafe_allow_html=True)
 
     def build_sidebar(self):
 
@@ -250,13 +406,36 @@ class ViewController:
             label = 'Page',
             options= pages
         )
+        self.fast_preview = st.sidebar.checkbox('Quick preview of big chats', value=True)
+        self.interactive_charts = st.sidebar.checkbox('Interactive charts, drawn by your browser')
+        self.show_performance = st.sidebar.checkbox('Show performance panel')
         return selected_page
 
+    def build_performance_panel(self, trace):
+        st.sidebar.subheader('Performance')
+        st.sidebar.markdown(f"This rerun took **{trace.seconds * 1000:.0f} ms**, here's where it went:")
+        st.sidebar.table(trace.to_frame())
+        # Shared by every session, so this shows how loaded the whole server is
+        metrics = analysis_executor.metrics()
+        st.sidebar.markdown(f"**{metrics['running']}** of **{metrics['workers']}** analysis workers are busy and "
+                            f"**{metrics['queued']}** analyses are waiting for one")
+        st.sidebar.table(pd.Series(metrics, name='Analyses').astype(str).to_frame())
+        df = peek_df(*self.loaded_chat) if self.loaded_chat is not None else None
+        if df is not None:
+            report = memory_report(df)
+            st.sidebar.markdown(f"The chat takes **{report.loc['Total', 'bytes'] / 2 ** 20:.1f} MB** in memory, "
+                                f"**{report.loc['Total', 'bytes per message']:.0f} bytes** per message:")
+            st.sidebar.table(report.round(1).astype(str))
+
     def build_ui(self):
+        trace = start_trace('rerun')
+        self.loaded_chat = None
         selected_page = self.build_sidebar()
         if selected_page == 'WhatsApp Chat Analyser':
             self.build_graph_ui()
         elif selected_page == 'How does the Chat Analyser Work?':
             self.build_conversation_explanation()
         elif selected_page == 'About the Creator':
-            self.build_about_me_ui()
\ No newline at end of file
+            self.build_about_me_ui()
+        if self.show_performance:
+            self.build_performance_panel(trace)
\ No newline at end of file
@@ -1,100 +1,534 @@
+import io
+import itertools
+import os
 import pandas as pd
-import re
 import numpy as np
-from sklearn.preprocessing import OrdinalEncoder
-import streamlit as st
-
-
-def preprocess_df(df):
-    df['Message Length'] = df['Message'].apply(lambda x: len(x.split(' ')))
-    for subject in df['Subject'].unique():
-        df[subject] = df['Subject'].apply(lambda x: 1 if x == subject else 0)
-        df[f"{subject}_mlength"] = df[subject].values * df['Message Length']
-
-    df['Formatted Date'] = df.index.strftime('%b - %y').values
-
-    conv_codes, conv_changes = cluster_into_conversations(df)
-    df['Conv code'] = conv_codes
-    df['Conv change'] = conv_changes
-    is_reply, sender_changes = find_replies(df)
-    df['Is reply'] = is_reply
-    df['Sender change'] = sender_changes
-
-    reply_times, indices = calculate_times_on_trues(df, 'Is reply')
-    reply_times_df_list = []
-    reply_time_index = 0
-    for i in range(0, len(df)):
-        if i in indices:
-            reply_times_df_list.append(reply_times[reply_time_index].astype("timedelta64[m]").astype("float"))
-            reply_time_index = reply_time_index + 1
-        else:
-            reply_times_df_list.append(0)
-
-    df['Reply time'] = reply_times_df_list
-
-    inter_conv_times, indices = calculate_times_on_trues(df, 'Conv change')
-    inter_conv_times_df_list = []
-    inter_conv_time_index = 0
-    for i in range(0, len(df)):
-        if i in indices:
-            inter_conv_times_df_list.append(
-                inter_conv_times[inter_conv_time_index].astype("timedelta64[m]").astype("float"))
-            inter_conv_time_index = inter_conv_time_index + 1
+from instrumentation import report_progress, span
+from processing.aggregates import ChatAggregates
+from processing.archives import is_zip_file, open_chat_member
+from processing.cache import chat_cache, content_hash, content_length
+from processing.compact import compact_df, concat_frames, MESSAGE_DTYPE
+from processing.incremental import ChatSnapshot, find_previous_export, remember_export
+from processing.sampling import sample_windows, PREVIEW_MIN_BYTES
+from processing.sessions import SessionIndex, SESSION_COLUMNS
+from processing.text_stats import text_stats, TEXT_STAT_COLUMNS
+from processing.storage import is_columnar_file, load_chat
+from processing.dialects import ExportDialect, detect_dialect, DETECTION_SAMPLE_SIZE, DIALECTS, MIN_PARSED_RATIO
+
+
+HOUR_LABELS = [f'{hour:02d}' for hour in range(24)]
+# Columns of a parsed chat, everything else is derived from them
+PARSED_COLUMNS = ['Date', 'Subject', 'Message']
+# Every column preprocess_df can derive, in the order it derives them, with the derived columns each one needs
+DERIVED_COLUMNS = {
+    'Message Length': [],
+    'Characters': [],
+    'Emojis': [],
+    'Media': [],
+    'Deleted': [],
+    'Links': [],
+    'Formatted Date': [],
+    'Conv code': [],
+    'Conv change': [],
+    'Is reply': ['Conv code', 'Conv change'],
+    'Sender change': ['Conv code', 'Conv change'],
+    'Reply time': ['Is reply'],
+    'Inter conv time': ['Conv change'],
+    'Hour': [],
+    'Previous subject': [],
+}
+
+
+def required_columns(columns : list = None):
+    """The given derived columns plus everything they depend on, all of them when columns is None."""
+    if columns is None:
+        return list(DERIVED_COLUMNS)
+    required = set()
+    pending = list(columns)
+    while pending:
+        column = pending.pop()
+        if column not in required:
+            required.add(column)
+            pending.extend(DERIVED_COLUMNS[column])
+    return [column for column in DERIVED_COLUMNS if column in required]
+
+
+def preprocess_df(df, inter_conversation_threshold_time: int = 60, columns : list = None,
+                  sessions : SessionIndex = None):
+    """
+    Adds the derived columns to df, only the requested ones and their dependencies when columns is given.
+    Columns df already has, like those of a chat saved with save_chat, are kept unless they depend on the
+    threshold. sessions is df's SessionIndex when one was already built.
+    """
+    columns = [
+        column for column in required_columns(columns) if column in SESSION_COLUMNS or column not in df.columns
+    ]
+    text_columns = [column for column in columns if column in TEXT_STAT_COLUMNS]
+    if len(text_columns) > 0:
+        for column, values in text_stats(df['Message'], text_columns).items():
+            df[column] = values
+
+    if 'Formatted Date' in columns:
+        df['Formatted Date'] = df.index.strftime('%b - %y').values
+
+    session_columns = [column for column in columns if column in SESSION_COLUMNS]
+    if len(session_columns) > 0:
+        # Conversations, replies and their times all come from the gaps between messages
+        if sessions is None:
+            sessions = SessionIndex.from_df(df)
+        session_values = sessions.columns(inter_conversation_threshold_time)
+        for column in session_columns:
+            df[column] = session_values[column]
+
+    if 'Hour' in columns:
+        df['Hour'] = pd.Categorical.from_codes(df.index.hour, HOUR_LABELS)
+
+    if 'Previous subject' in columns:
+        # Who sent the message before, which together with Is reply says who replied to whom
+        subjects = pd.Categorical(df['Subject'].values)
+        previous_codes = np.roll(subjects.codes, 1)
+        previous_codes[:1] = -1
+        df['Previous subject'] = pd.Categorical.from_codes(previous_codes, dtype=subjects.dtype)
+    return compact_df(df)
+
+MIN_MESSAGES = 1000
+# Parsing holds at most this much in Python strings before turning them into compact columns
+PARSE_MEMORY_BUDGET_BYTES = int(os.environ.get('WHATSAPP_ANALYSER_PARSE_MEMORY_MB', 64)) << 20
+# Generous estimate of the date, subject and message strings of one message plus their list slots
+PARSED_MESSAGE_BYTES = 512
+PROGRESS_INTERVAL = 10000
+
+
+def iter_chat_lines(raw_file_content, offset: int = 0):
+    # Decodes the upload incrementally instead of materialising every line at once
+    if raw_file_content.seekable():
+        raw_file_content.seek(offset)
+    text_stream = io.TextIOWrapper(raw_file_content, encoding='utf-8-sig', errors='replace', newline=None)
+    try:
+        for line in text_stream:
+            yield line.rstrip('\n')
+    finally:
+        # Detaching stops the wrapper from closing the uploaded file when it is garbage collected
+        text_stream.detach()
+
+
+def iter_chat_messages(lines, dialect: ExportDialect):
+    """
+    Yields (date, subject, message) tuples from an iterable of chat lines.
+    Lines before the first message header are ignored, system notices (lines without
+    a sender) are skipped and multi-line messages are joined back together with newlines.
+    """
+    pattern = dialect.pattern
+    current = None
+    for line in lines:
+        match = pattern.match(line)
+        if match is None:
+            # This line continues the message above it
+            if current is not None:
+                current[2].append(line)
+            continue
+        if current is not None:
+            yield current[0], current[1], '\n'.join(current[2])
+        if match.group('subject') is None:
+            current = None
         else:
-            inter_conv_times_df_list.append(0)
+            current = (match.group('date'), match.group('subject'), [match.group('message')])
+    if current is not None:
+        yield current[0], current[1], '\n'.join(current[2])
+
+
+class ChatParseError(ValueError):
+    """
+    Raised when an upload can't be analysed, with a message meant for the user. Parsing runs on the
+    shared analysis workers, where Streamlit calls go nowhere, so the session waiting for it shows it.
+    """
+
+
+def create_df_from_raw_file(raw_file_content, total_bytes : int = None):
+    """
+    total_bytes is the size of raw_file_content for progress reports when it can't be seeked to find out.
+    Raises ChatParseError when the file isn't a chat export or is too short to analyse.
+    """
+    if total_bytes is None and raw_file_content.seekable():
+        total_bytes = content_length(raw_file_content)
+    lines = iter_chat_lines(raw_file_content)
+    # Only a bounded sample at the start of the file is used to work out its format
+    sample = list(itertools.islice(lines, DETECTION_SAMPLE_SIZE))
+    dialect = detect_dialect(sample)
+    if dialect is None:
+        raise ChatParseError("We couldn't recognise the format of this file, please upload a WhatsApp chat export")
+
+    def on_progress():
+        # The decoder reads ahead of the parser, so this slightly overstates how far along it is
+        report_progress(raw_file_content.tell() / total_bytes)
 
-    df['Inter conv time'] = inter_conv_times_df_list
+    df = create_df_from_lines(itertools.chain(sample, lines), dialect, on_progress if total_bytes else None)
+    unparsed = df.attrs['unparsed messages']
+    if len(df) < MIN_PARSED_RATIO * (len(df) + unparsed):
+        raise ChatParseError(f"{unparsed} messages have dates that don't look like the rest of the chat, please "
+                             f"upload the export exactly as WhatsApp wrote it")
+    if len(df) < MIN_MESSAGES:
+        raise ChatParseError('These analysis need more data to work, at least 1000 messages exchanged, please come back after chatting to that person more!')
+    return df
+
+
+def create_df_from_lines(lines, dialect: ExportDialect, on_progress=None):
+    """
+    Builds the chat's frame in a single pass over the lines, converting every chunk of messages that
+    fits in PARSE_MEMORY_BUDGET_BYTES to compact columns before reading the next one.
+    on_progress is called every PROGRESS_INTERVAL messages. Messages whose timestamp doesn't parse are left
+    out and counted in df.attrs['unparsed messages'].
+    """
+    chunk_messages = max(PARSE_MEMORY_BUDGET_BYTES // PARSED_MESSAGE_BYTES, 1)
+    chunks = []
+    unparsed = 0
+    dates, subjects, messages = [], [], []
+    for count, (date, subject, message) in enumerate(iter_chat_messages(lines, dialect), start=1):
+        dates.append(date)
+        subjects.append(subject)
+        messages.append(message)
+        if len(dates) >= chunk_messages:
+            chunks.append(create_df_from_messages(dates, subjects, messages, dialect))
+            unparsed += len(dates) - len(chunks[-1])
+            dates, subjects, messages = [], [], []
+        if on_progress is not None and count % PROGRESS_INTERVAL == 0:
+            on_progress()
+    chunks.append(create_df_from_messages(dates, subjects, messages, dialect))
+    unparsed += len(dates) - len(chunks[-1])
 
-    df['Hour'] = df['Date'].apply(lambda x: x.strftime('%H'))
+    df = concat_frames(chunks)
+    # Remembered so a newer export of the same chat can be parsed from where this one ended
+    df.attrs['dialect'] = dialect.name
+    df.attrs['unparsed messages'] = unparsed
     return df
 
-def create_df_from_raw_file(raw_file_content):
-    # Separates rows in readlines and removes the carriage return character
-    rows = [row.decode('utf-8')[:-1] for row in raw_file_content.readlines()]
-    for row in rows:
-        print(row, len(rows))
-    pattern_matches = pd.DataFrame([
-        ['English', '^\d*/\d*/\d*'],
-        ['German', '^\[\d*.\d*.\d*, \d*:\d*:\d*\] .*: .*'],
-    ], columns= ['Country', 'Pattern'])
-    pattern_matches.index = pattern_matches['Country']
-    pattern_matches['Number_of_matches'] = pattern_matches['Pattern'].apply(lambda x : len([row for row in rows if re.match(x, row)]))
-    if pattern_matches['Number_of_matches'].max() < 1000:
-        st.error('These analysis need more data to work, at least 1000 messages exchanged, please come back after chatting to that person more!')
+
+def create_df_from_messages(dates : list, subjects : list, messages : list, dialect: ExportDialect,
+                            extra_columns : dict = None):
+    """extra_columns, one value per message, are added as columns so they stay aligned with the messages that parse."""
+    datetime = dialect.parse_dates(dates)
+    # Subjects and messages go straight into their compact dtypes, per-subject values are grouped from the
+    # categorical subject on demand instead of being stored as mostly zero columns for every participant
+    df = pd.DataFrame({
+        'Date': datetime,
+        'Subject': pd.Categorical(subjects),
+        'Message': pd.array(messages, dtype=MESSAGE_DTYPE),
+    }, index=datetime)
+    for column, values in (extra_columns or {}).items():
+        df[column] = values
+    # Timestamps that don't fit the detected format can't be placed in the timeline, callers count them
+    return df[df.index.notna()]
+
+
+def hash_upload(raw_file_content):
+    with span('hash upload'):
+        return content_hash(raw_file_content)
+
+
+def get_parsed_df(raw_file_content, chat_hash: str = None, columns : list = None):
+    # Parsing is cached on its own, so asking for more derived columns later only runs the preprocessing
+    if chat_hash is None:
+        chat_hash = hash_upload(raw_file_content)
+    key = chat_cache.make_key(chat_hash, kind='parsed')
+    return chat_cache.get_or_compute(key, lambda: parse_file(raw_file_content, columns))
+
+
+def peek_unparsed_messages(chat_hash: str):
+    """How many messages of the chat were left out for their dates, 0 when its parse isn't cached."""
+    parsed = chat_cache.get(chat_cache.make_key(chat_hash, kind='parsed'))
+    return parsed.attrs.get('unparsed messages', 0) if parsed is not None else 0
+
+
+def get_df_from_data(raw_file_content, inter_conversation_threshold_time: int = 60, chat_hash: str = None,
+                     columns : list = None):
+    # Reruns with the same upload and parameters are served from the cache instead of parsing again
+    if chat_hash is None:
+        chat_hash = hash_upload(raw_file_content)
+    columns = required_columns(columns)
+    key = chat_cache.make_key(
+        chat_hash,
+        inter_conversation_threshold_time=inter_conversation_threshold_time,
+        columns=tuple(columns)
+    )
+
+    def build_df():
+        df = extend_previous_df(raw_file_content, chat_hash, inter_conversation_threshold_time, columns)
+        if df is not None:
+            return df
+        # Only the session columns depend on the threshold, the rest is shared by every threshold
+        base_columns = [column for column in columns if column not in SESSION_COLUMNS]
+        df = get_threshold_free_df(raw_file_content, chat_hash, base_columns)
+        session_columns = [column for column in columns if column in SESSION_COLUMNS]
+        if len(session_columns) > 0:
+            sessions = get_sessions(raw_file_content, chat_hash)
+            with span('sessionize', rows=len(df), threshold=inter_conversation_threshold_time):
+                # The shallow copy leaves the cached frame untouched while sharing its data
+                df = preprocess_df(df.copy(deep=False), inter_conversation_threshold_time, session_columns, sessions)
+        remember_export(raw_file_content, chat_hash, df.attrs.get('dialect'), df, inter_conversation_threshold_time,
+                        columns)
+        return df
+
+    return chat_cache.get_or_compute(key, build_df)
+
+
+def get_threshold_free_df(raw_file_content, chat_hash: str, columns : list):
+    """The parsed chat with the given derived columns that don't depend on the conversation threshold."""
+    key = chat_cache.make_key(chat_hash, columns=tuple(columns), kind='threshold free')
+
+    def build_df():
+        parsed = get_parsed_df(raw_file_content, chat_hash, columns)
+        with span('preprocess', rows=len(parsed), columns=len(columns)):
+            # The shallow copy leaves the cached parse untouched while sharing its data
+            return preprocess_df(parsed.copy(deep=False), columns=columns)
+
+    return chat_cache.get_or_compute(key, build_df)
+
+
+def sessions_key(chat_hash: str):
+    return chat_cache.make_key(chat_hash, kind='sessions')
+
+
+def peek_sessions(chat_hash: str):
+    """The SessionIndex get_sessions would return when it is already cached, otherwise None."""
+    return chat_cache.get(sessions_key(chat_hash))
+
+
+def get_sessions(raw_file_content, chat_hash: str = None):
+    """The chat's SessionIndex, built once and shared by every threshold."""
+    if chat_hash is None:
+        chat_hash = hash_upload(raw_file_content)
+    key = sessions_key(chat_hash)
+
+    def build_sessions():
+        # The gaps only need the dates and subjects
+        parsed = get_parsed_df(raw_file_content, chat_hash, columns=[])
+        with span('index sessions', rows=len(parsed)):
+            return SessionIndex.from_df(parsed)
+
+    return chat_cache.get_or_compute(key, build_sessions)
+
+
+def aggregates_columns(columns : list = None):
+    return required_columns(None if columns is None else list(columns) + ChatAggregates.REQUIRED_COLUMNS)
+
+
+def aggregates_key(chat_hash: str, inter_conversation_threshold_time: int, columns : list):
+    if not any(column in SESSION_COLUMNS for column in columns):
+        # Nothing else depends on the threshold, so these aggregates are shared by every threshold
+        inter_conversation_threshold_time = None
+    return chat_cache.make_key(
+        chat_hash,
+        inter_conversation_threshold_time=inter_conversation_threshold_time,
+        columns=tuple(columns),
+        kind='aggregates'
+    )
+
+
+def peek_aggregates(chat_hash: str, inter_conversation_threshold_time: int = 60, columns : list = None):
+    """The aggregates get_aggregates_from_data would return when they are already cached, otherwise None."""
+    return chat_cache.get(aggregates_key(chat_hash, inter_conversation_threshold_time, aggregates_columns(columns)))
+
+
+def peek_df(chat_hash: str, inter_conversation_threshold_time: int = 60, columns : list = None):
+    """The frame get_aggregates_from_data aggregated when it is still cached, otherwise None."""
+    return chat_cache.get(chat_cache.make_key(
+        chat_hash,
+        inter_conversation_threshold_time=inter_conversation_threshold_time,
+        columns=tuple(aggregates_columns(columns))
+    ))
+
+
+def get_aggregates_from_data(raw_file_content, inter_conversation_threshold_time: int = 60, chat_hash: str = None,
+                             columns : list = None):
+    # The aggregates are cached alongside the frame so interactive filtering never touches the messages
+    if chat_hash is None:
+        chat_hash = hash_upload(raw_file_content)
+    columns = aggregates_columns(columns)
+    key = aggregates_key(chat_hash, inter_conversation_threshold_time, columns)
+
+    def build_aggregates():
+        aggregates = extend_previous_aggregates(raw_file_content, chat_hash, inter_conversation_threshold_time, columns)
+        if aggregates is not None:
+            return aggregates
+        df = get_df_from_data(raw_file_content, inter_conversation_threshold_time, chat_hash, columns)
+        with span('aggregate', rows=len(df)):
+            return ChatAggregates.from_df(df)
+
+    with span('load aggregates') as record:
+        aggregates = chat_cache.get_or_compute(key, build_aggregates)
+        record['rows'] = len(aggregates.cube)
+    return aggregates
+
+
+def preprocess_new_messages(raw_file_content, previous : ChatSnapshot, inter_conversation_threshold_time: int,
+                            columns : list):
+    """
+    Parses and preprocesses only the messages a newer export has after the previous one ended.
+    The previous export's last message is preprocessed along with them so conversation changes,
+    replies and reply times carry on across the boundary, then dropped again.
+    """
+    with span('parse new messages') as record:
+        df = create_df_from_lines(iter_chat_lines(raw_file_content, previous.content_length),
+                                  DIALECTS[previous.dialect])
+        record['rows'] = len(df)
+    boundary = pd.DataFrame({
+        'Date': [previous.last_date],
+        'Subject': pd.Categorical([previous.last_subject]),
+        'Message': pd.array([''], dtype=MESSAGE_DTYPE),
+    }, index=pd.DatetimeIndex([previous.last_date]))
+    with span('preprocess new messages', rows=len(df)):
+        df = preprocess_df(concat_frames([boundary, df]), inter_conversation_threshold_time, columns).iloc[1:].copy()
+    if 'Conv code' in df.columns:
+        # Codes were counted from the boundary message, which keeps its code from the previous export
+        df['Conv code'] += previous.last_conv_code
+    return df
+
+
+def extend_previous_df(raw_file_content, chat_hash: str, inter_conversation_threshold_time: int, columns : list):
+    """Frame of an export built from the cached frame of an older export of the same chat, None when there isn't one."""
+    previous = find_previous_export(raw_file_content, inter_conversation_threshold_time, columns)
+    if previous is None:
+        return None
+    previous_df = chat_cache.get(chat_cache.make_key(
+        previous.content_hash,
+        inter_conversation_threshold_time=inter_conversation_threshold_time,
+        columns=tuple(columns)
+    ))
+    if previous_df is None:
+        return None
+    new_messages = preprocess_new_messages(raw_file_content, previous, inter_conversation_threshold_time, columns)
+    df = concat_frames([previous_df, new_messages])
+    remember_export(raw_file_content, chat_hash, previous.dialect, df, inter_conversation_threshold_time, columns)
+    return df
+
+
+def extend_previous_aggregates(raw_file_content, chat_hash: str, inter_conversation_threshold_time: int,
+                               columns : list):
+    """Aggregates of an export updated from the cached aggregates of an older export, without the older messages."""
+    previous = find_previous_export(raw_file_content, inter_conversation_threshold_time, columns)
+    if previous is None:
+        return None
+    previous_aggregates = chat_cache.get(chat_cache.make_key(
+        previous.content_hash,
+        inter_conversation_threshold_time=inter_conversation_threshold_time,
+        columns=tuple(columns),
+        kind='aggregates'
+    ))
+    if previous_aggregates is None:
+        return None
+    new_messages = preprocess_new_messages(raw_file_content, previous, inter_conversation_threshold_time, columns)
+    # Nothing but system notices arrived, the previous snapshot still marks the last message
+    if len(new_messages) == 0:
+        return previous_aggregates
+    with span('merge aggregates', rows=len(new_messages)):
+        aggregates = previous_aggregates.merge(ChatAggregates.from_df(new_messages))
+    remember_export(raw_file_content, chat_hash, previous.dialect, new_messages, inter_conversation_threshold_time,
+                    columns)
+    return aggregates
+
+
+def get_preview_aggregates(raw_file_content, inter_conversation_threshold_time: int = 60, chat_hash: str = None,
+                           columns : list = None):
+    """
+    Approximate aggregates of a big text export from a time stratified sample of it, quick enough
+    to show while the whole file is processed. None for uploads too small to need a preview and
+    for zip and columnar files, which can't be sampled without reading them whole.
+    """
+    total_bytes = content_length(raw_file_content)
+    if total_bytes < PREVIEW_MIN_BYTES or is_zip_file(raw_file_content) or is_columnar_file(raw_file_content):
         return None
-    else:
-        matched_country = pattern_matches.sort_values(by = 'Number_of_matches', ascending=False)['Country'].values[0]
-        if matched_country == 'English':
-            valid_rows = [row for row in rows if re.match(pattern_matches.loc[matched_country]['Pattern'], row)]
-            ignore_rows = 10
-            datetime = pd.DatetimeIndex([row.split(' - ')[0] for row in valid_rows[ignore_rows:]])
-            subjects = [row.split(', ')[1].split(' - ')[1].split(':')[0] for row in valid_rows[ignore_rows:]]
-            messages = [(':'.join(row.split(', ')[1].split(' - ')[1].split(': ')[1:])) for row in
-                        valid_rows[ignore_rows:]]
-            df = pd.DataFrame(
-                zip(pd.to_datetime(datetime), subjects, messages),
-                columns=['Date', 'Subject', 'Message'],
-                index=datetime
-            )
-        elif matched_country == 'German':
-            valid_rows = [row for row in rows if re.match(pattern_matches.loc[matched_country]['Pattern'], row)]
-            ignore_rows = 10
-            datetime = pd.DatetimeIndex([row.split('] ')[0][1:] for row in valid_rows[ignore_rows:]], dayfirst=True)
-            subjects = [row.split('] ')[1].split(':')[0] for row in valid_rows[ignore_rows:]]
-            messages = [(':'.join(row.split('] ')[1].split(':')[1:])) for row in
-                        valid_rows[ignore_rows:]]
-            df = pd.DataFrame(
-                zip(pd.to_datetime(datetime), subjects, messages),
-                columns=['Date', 'Subject', 'Message'],
-                index=datetime
-            )
-        print(df)
+    if chat_hash is None:
+        chat_hash = hash_upload(raw_file_content)
+    columns = aggregates_columns(columns)
+    key = chat_cache.make_key(
+        chat_hash,
+        inter_conversation_threshold_time=inter_conversation_threshold_time,
+        columns=tuple(columns),
+        kind='preview aggregates'
+    )
+
+    def build_preview():
+        with span('sample') as record:
+            windows = sample_windows(raw_file_content, total_bytes)
+            dialect = detect_dialect(windows[0][0][:DETECTION_SAMPLE_SIZE])
+            if dialect is None:
+                return None
+            dates, subjects, messages, weights, window_numbers = [], [], [], [], []
+            for window_number, (lines, weight) in enumerate(windows):
+                for date, subject, message in iter_chat_messages(lines, dialect):
+                    dates.append(date)
+                    subjects.append(subject)
+                    messages.append(message)
+                    weights.append(weight)
+                    window_numbers.append(window_number)
+            # Parsed in one go, per window frames would spend most of their time on per call overhead
+            df = create_df_from_messages(dates, subjects, messages, dialect,
+                                         {'Weight': weights, 'Window': window_numbers})
+            weights = df.pop('Weight').values
+            window_numbers = df.pop('Window').values
+            record['rows'] = len(df)
+        with span('preprocess sample', rows=len(df)):
+            df = preprocess_df(df, inter_conversation_threshold_time, columns)
+            window_starts = window_numbers != np.roll(window_numbers, 1)
+            window_starts[:1] = False
+            clear_window_starts(df, window_starts)
+        with span('aggregate sample', rows=len(weights)):
+            return ChatAggregates.from_df(df, weights)
+
+    return chat_cache.get_or_compute(key, build_preview)
+
+
+def clear_window_starts(df : pd.DataFrame, window_starts : np.ndarray):
+    """
+    Makes the first message of every sampled window start afresh like a chat's first message, instead of
+    following the last message of the window before, which was hours or days earlier. It still gets a
+    conversation code of its own, so no conversation runs across windows.
+    """
+    for column in ['Conv change', 'Is reply', 'Sender change']:
+        if column in df.columns:
+            df[column] = df[column].values & ~window_starts
+    for column in ['Reply time', 'Inter conv time']:
+        if column in df.columns:
+            df[column] = np.where(window_starts, 0, df[column].values).astype(df[column].dtype)
+    if 'Conv code' in df.columns:
+        codes = df['Conv code'].values
+        changes = np.diff(codes, prepend=codes[:1]) != 0
+        df['Conv code'] = np.cumsum(changes | window_starts).astype(codes.dtype)
+
+
+def parse_file(raw_file_content, columns : list = None):
+    """
+    columns are the derived columns the chat is wanted for, a saved chat is only read for those and the parse.
+    Raises ChatParseError for uploads that can't be analysed.
+    """
+    # Chats saved with processing.storage.save_chat are already preprocessed, the columns that depend on the
+    # threshold are left out since preprocess_df works them out again for whichever threshold is asked for
+    if is_columnar_file(raw_file_content):
+        with span('load columnar file') as record:
+            if columns is not None:
+                columns = PARSED_COLUMNS + [
+                    column for column in required_columns(columns) if column not in SESSION_COLUMNS
+                ]
+            df = load_chat(raw_file_content, columns)
+            record['rows'] = len(df)
+        return df
+    if is_zip_file(raw_file_content):
+        with span('parse zip') as record, open_chat_member(raw_file_content) as (chat_file, chat_size):
+            if chat_file is None:
+                raise ChatParseError("We couldn't find a chat in this zip file, please upload the zip WhatsApp exported")
+            df = create_df_from_raw_file(chat_file, chat_size)
+            record['rows'] = len(df)
         return df
+    with span('parse') as record:
+        df = create_df_from_raw_file(raw_file_content)
+        record['rows'] = len(df)
+    return df
 
 
-def get_df_from_data(raw_file_content):
-    df = create_df_from_raw_file(raw_file_content)
-    preprocessed = preprocess_df(df)
+def parse_and_preprocess(raw_file_content, inter_conversation_threshold_time: int = 60, columns : list = None):
+    df = parse_file(raw_file_content)
+    with span('preprocess', rows=len(df)):
+        preprocessed = preprocess_df(df, inter_conversation_threshold_time, columns)
     return preprocessed
 
 
@@ -102,33 +536,20 @@ def cluster_into_conversations(df : pd.DataFrame, inter_conversation_threshold_t
     threshold_time_mins = np.timedelta64(inter_conversation_threshold_time, 'm')
 
     # This calculates the time between the current message and the previous one
-    conv_delta = df.index.values - np.roll(df.index.values, 1)
-    conv_delta[0] = 0
+    conv_delta = message_time_deltas(df)
 
     # This detects where the time between messages is higher than the threshold
     conv_changes = conv_delta > threshold_time_mins
-    conv_changes_indices = np.where(conv_changes)[0]
-    conv_codes = []
-
-    # This encodes each message with its own conversation code
-    last_conv_change = 0
-    for i, conv_change in enumerate(conv_changes_indices):
-        conv_codes.extend([i]*(conv_change - last_conv_change))
-        last_conv_change = conv_change
 
-    # This serves to ensure that the conversation codes and the number of messages are aligned
-    conv_codes = pad_list_to_value(conv_codes, len(df), conv_codes[-1])
-    conv_changes = pad_list_to_value(conv_changes, len(df), False)
+    # This encodes each message with its own conversation code, which goes up by one on every change
+    conv_codes = np.cumsum(conv_changes)
 
     return conv_codes, conv_changes
 
 
-def pad_list_to_value(input_list : list, length : int, value):
-    assert(length >= len(input_list))
-    output_list = list(input_list)
-    padding = [value]*(length - len(output_list))
-    output_list.extend(padding)
-    return np.array(output_list)
+def message_time_deltas(df : pd.DataFrame):
+    # The first message has no previous one, so its delta is zero
+    return np.diff(df.index.values, prepend=df.index.values[:1])
 
 
 def find_replies(df : pd.DataFrame):
@@ -136,11 +557,11 @@ def find_replies(df : pd.DataFrame):
     assert('Conv code' in df.columns)
     assert('Conv change' in df.columns)
     assert('Subject' in df.columns)
-    # Ordinal encoders will encode each subject with its own number
-    message_senders = OrdinalEncoder().fit_transform(df['Subject'].values.reshape(-1,1))
+    # Factorizing encodes each subject with its own number, categorical subjects already are
+    message_senders, _ = pd.factorize(df['Subject'])
     # This compares the current subject with the previous subject
     # In a way that computers can optimize
-    sender_changed = (np.roll(message_senders, 1) - message_senders).reshape(1, -1)[0] != 0
+    sender_changed = np.roll(message_senders, 1) != message_senders
     sender_changed[0] = False
     # This checks if the reply isn't within a different conversation
     is_reply = sender_changed & ~df['Conv change']
@@ -149,6 +570,6 @@ def find_replies(df : pd.DataFrame):
 
 def calculate_times_on_trues(df : pd.DataFrame, column : str):
     assert(column in df.columns)
-    true_indices = np.where(df[column])[0]
-    inter_conv_time = [df.index.values[ind] - df.index.values[ind-1] for ind in true_indices]
-    return inter_conv_time, true_indices
\ No newline at end of file
+    # Minutes since the previous message wherever the column is true, zero everywhere else
+    minutes = message_time_deltas(df).astype('timedelta64[m]').astype('float')
+    return np.where(df[column].values, minutes, 0)
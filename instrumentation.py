@@ -0,0 +1,121 @@
+import contextlib
+import json
+import logging
+import sys
+import threading
+import time
+
+import pandas as pd
+
+try:
+    import resource
+except ImportError:
+    # Windows has no resource module, peak memory is simply not reported there
+    resource = None
+
+logger = logging.getLogger('whatsapp_analyser.performance')
+_local = threading.local()
+
+
+def peak_memory_bytes():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+class Trace:
+    """
+    The spans recorded during one unit of work, usually a single Streamlit rerun.
+    Every span is also logged as a JSON line on the whatsapp_analyser.performance logger.
+    """
+    def __init__(self, name : str):
+        self.name = name
+        self.spans = []
+        self.started = time.perf_counter()
+        self._depth = 0
+
+    @contextlib.contextmanager
+    def span(self, name : str, **attributes):
+        """
+        Times the enclosed block. The yielded dict can be updated with anything worth
+        recording, e.g. record['rows'] = len(df).
+        """
+        record = {'name': name, 'depth': self._depth, **attributes}
+        peak_before = peak_memory_bytes()
+        self._depth += 1
+        started = time.perf_counter()
+        record['offset'] = started - self.started
+        try:
+            yield record
+        finally:
+            record['seconds'] = time.perf_counter() - started
+            self._depth -= 1
+            peak_after = peak_memory_bytes()
+            if peak_after is not None:
+                record['peak_memory_bytes'] = peak_after
+                record['peak_memory_growth_bytes'] = peak_after - peak_before
+            self.spans.append(record)
+            logger.info(json.dumps({'trace': self.name, **record}, default=str))
+
+    def adopt(self, other):
+        """Adds the spans of a trace recorded on another thread, nested under whatever span is open here."""
+        shift = other.started - self.started
+        for record in list(other.spans):
+            self.spans.append({**record, 'depth': record['depth'] + self._depth, 'offset': record['offset'] + shift})
+
+    @property
+    def seconds(self):
+        return time.perf_counter() - self.started
+
+    def to_frame(self):
+        """One row per span in the order they started, names indented by nesting depth."""
+        if len(self.spans) == 0:
+            return pd.DataFrame(columns=['Stage', 'ms', 'Rows', 'Peak MB'])
+        # Spans are appended as they finish, so nested ones come before their parents
+        spans = sorted(self.spans, key=lambda span: span['offset'])
+        return pd.DataFrame([{
+            'Stage': '\u00b7 ' * span['depth'] + span['name'],
+            'ms': round(span['seconds'] * 1000, 1),
+            'Rows': span.get('rows', ''),
+            'Peak MB': round(span['peak_memory_bytes'] / 2 ** 20) if 'peak_memory_bytes' in span else '',
+        } for span in spans])
+
+
+def start_trace(name : str):
+    """Starts a new trace for the current thread, which is where Streamlit runs each session's script."""
+    _local.trace = Trace(name)
+    return _local.trace
+
+
+def current_trace():
+    return getattr(_local, 'trace', None)
+
+
+@contextlib.contextmanager
+def span(name : str, **attributes):
+    """Records a span on the current thread's trace, or just logs it when no trace was started."""
+    trace = current_trace()
+    if trace is None:
+        trace = Trace(name)
+    with trace.span(name, **attributes) as record:
+        yield record
+
+
+@contextlib.contextmanager
+def progress_callback(callback):
+    """Sends report_progress calls made on this thread inside the block to callback(fraction)."""
+    previous = getattr(_local, 'progress', None)
+    _local.progress = callback
+    try:
+        yield
+    finally:
+        _local.progress = previous
+
+
+def report_progress(fraction : float):
+    """Reports how far along the current long running step is, between 0 and 1, when anyone is listening."""
+    callback = getattr(_local, 'progress', None)
+    if callback is not None:
+        callback(min(max(fraction, 0.0), 1.0))
@@ -0,0 +1,271 @@
+import numpy as np
+import pandas as pd
+
+from processing.compact import concat_frames
+from processing.sketches import bucket_index, sketch_quantiles
+
+CUBE_KEYS = ['Day', 'Subject', 'Hour']
+CONVERSATION_KEYS = ['Conv code', 'Day', 'Subject']
+REPLY_KEYS = ['Day', 'Subject', 'Previous subject']
+REPLY_AGGREGATIONS = {'Replies': 'sum', 'Reply time sum': 'sum', 'Reply time max': 'max'}
+LATENCY_KEYS = ['Day', 'Subject', 'Latency', 'Bucket']
+# Latencies sketched, each with the column that marks the messages it applies to
+LATENCY_MARKERS = {'Reply time': 'Is reply', 'Inter conv time': 'Conv change'}
+# Text statistics columns the cube sums under the same name
+TEXT_STAT_SUMS = ['Characters', 'Emojis', 'Links', 'Media', 'Deleted']
+
+
+class ChatAggregates:
+    """
+    Pre-aggregated view of a preprocessed chat, built once so that date range and
+    subject filters can be answered by slicing small tables instead of the messages.
+
+    cube: message counts, word, character, emoji, link, media and deleted message sums,
+        reply time sums/counts and conversation starts bucketed by day, subject and hour. Days rather than weeks keep date range
+        slices exact to the day, weekly series are resampled from them.
+    conversations: message counts and timestamp sums per conversation, day and
+        subject, which is what conversation sizes and their mean dates need.
+    replies: reply counts and reply time sums and maxima per day, replying subject
+        and the subject replied to, only for the pairs that ever replied to each other,
+        so it grows with the replies rather than with the square of the participants.
+    latencies: quantile sketches (see processing.sketches) of the reply and inter conversation
+        times per day and subject, as message counts per sketch bucket. Sketches of any date range
+        and subjects merge by adding their counts, so quantiles are read without the messages.
+    """
+    # Hour is part of the cube key, everything else is aggregated only when the frame has it
+    REQUIRED_COLUMNS = ['Hour']
+
+    def __init__(self, cube: pd.DataFrame, conversations: pd.DataFrame, replies: pd.DataFrame = None,
+                 latencies: pd.DataFrame = None):
+        self.cube = cube
+        self.conversations = conversations
+        self.replies = replies if replies is not None else pd.DataFrame(columns=REPLY_KEYS + list(REPLY_AGGREGATIONS))
+        self.latencies = latencies if latencies is not None else pd.DataFrame(columns=LATENCY_KEYS + ['Count'])
+
+    @classmethod
+    def from_df(cls, df : pd.DataFrame, weights : np.ndarray = None):
+        """
+        weights, when given, is how many messages of the whole chat each row of a sampled df stands
+        for, every count and sum is scaled by it so the aggregates approximate the whole chat.
+        """
+        def weigh(values):
+            return values if weights is None else values * weights
+
+        keyed = pd.DataFrame({
+            'Day': df.index.normalize(),
+            'Subject': df['Subject'].values,
+            'Hour': df['Hour'].values,
+            'Messages': 1 if weights is None else weights,
+            'First': df.index.values,
+            'Last': df.index.values,
+        })
+        cube_aggregations = {'Messages': 'sum', 'First': 'min', 'Last': 'max'}
+        # Sums are accumulated in 64 bits even though the message columns are stored narrower
+        is_text = None
+        if 'Media' in df.columns and 'Deleted' in df.columns:
+            # Media placeholders and deletion notices are WhatsApp's words, not the sender's
+            is_text = ~(df['Media'].values | df['Deleted'].values)
+            keyed['Text messages'] = weigh(is_text.astype(np.int64))
+            cube_aggregations['Text messages'] = 'sum'
+        if 'Message Length' in df.columns:
+            words = df['Message Length'].values.astype(np.int64)
+            keyed['Words'] = weigh(words if is_text is None else words * is_text)
+            cube_aggregations['Words'] = 'sum'
+        for column in TEXT_STAT_SUMS:
+            if column in df.columns:
+                keyed[column] = weigh(df[column].values.astype(np.int64))
+                cube_aggregations[column] = 'sum'
+        if 'Reply time' in df.columns:
+            keyed['Reply time sum'] = weigh(df['Reply time'].values.astype(np.float64))
+            keyed['Replies'] = weigh(df['Is reply'].values.astype(int))
+            cube_aggregations.update({'Reply time sum': 'sum', 'Replies': 'sum'})
+        if 'Conv change' in df.columns:
+            keyed['Conv starts'] = weigh(df['Conv change'].values.astype(int))
+            cube_aggregations['Conv starts'] = 'sum'
+        cube = keyed.groupby(CUBE_KEYS, sort=True, observed=True).agg(cube_aggregations).reset_index()
+
+        if 'Conv code' in df.columns:
+            # A sampled conversation stands for weight conversations of its own size, so sizes aren't weighted
+            conversations = pd.DataFrame({
+                'Conv code': df['Conv code'].values,
+                'Day': keyed['Day'].values,
+                'Subject': keyed['Subject'].values,
+                'Messages': 1,
+                # Seconds since the epoch fit comfortably in a float64 sum, nanoseconds would overflow int64
+                'Date sum': df.index.values.astype('datetime64[s]').astype('float'),
+            }).groupby(CONVERSATION_KEYS, sort=True, observed=True).agg({
+                'Messages': 'sum',
+                'Date sum': 'sum',
+            }).reset_index()
+        else:
+            conversations = pd.DataFrame(columns=CONVERSATION_KEYS + ['Messages', 'Date sum'])
+
+        replies = None
+        if 'Reply time' in df.columns and 'Previous subject' in df.columns:
+            is_reply = df['Is reply'].values.astype(bool)
+            replies = pd.DataFrame({
+                'Day': keyed['Day'].values[is_reply],
+                'Subject': keyed['Subject'].values[is_reply],
+                'Previous subject': df['Previous subject'].values[is_reply],
+                'Replies': keyed['Replies'].values[is_reply],
+                'Reply time sum': keyed['Reply time sum'].values[is_reply],
+                'Reply time max': df['Reply time'].values[is_reply].astype(np.float64),
+            }).groupby(REPLY_KEYS, sort=True, observed=True).agg(REPLY_AGGREGATIONS).reset_index()
+
+        latencies = []
+        for latency, marker in LATENCY_MARKERS.items():
+            if latency not in df.columns:
+                continue
+            marked = df[marker].values.astype(bool)
+            latencies.append(pd.DataFrame({
+                'Day': keyed['Day'].values[marked],
+                'Subject': keyed['Subject'].values[marked],
+                'Latency': pd.Categorical([latency] * int(marked.sum()), categories=list(LATENCY_MARKERS)),
+                'Bucket': bucket_index(df[latency].values[marked]),
+                'Count': weigh(np.ones(len(df), dtype=np.int64))[marked],
+            }))
+        if len(latencies) > 0:
+            latencies = concat_frames(latencies).groupby(LATENCY_KEYS, sort=True, observed=True).agg(
+                {'Count': 'sum'}).reset_index()
+        else:
+            latencies = None
+        return cls(cube, conversations, replies, latencies)
+
+    def merge(self, other):
+        """Aggregates of both chats together, which is how newly arrived messages are folded in."""
+        cube = concat_frames([self.cube, other.cube])
+        cube_aggregations = {
+            column: {'First': 'min', 'Last': 'max'}.get(column, 'sum')
+            for column in cube.columns if column not in CUBE_KEYS
+        }
+        conversations = concat_frames([self.conversations, other.conversations])
+        replies = concat_frames([self.replies, other.replies])
+        # Merging sketches is adding up their bucket counts
+        latencies = concat_frames([self.latencies, other.latencies])
+        return ChatAggregates(
+            cube.groupby(CUBE_KEYS, sort=True, observed=True).agg(cube_aggregations).reset_index(),
+            conversations.groupby(CONVERSATION_KEYS, sort=True, observed=True).sum().reset_index(),
+            replies.groupby(REPLY_KEYS, sort=True, observed=True).agg(REPLY_AGGREGATIONS).reset_index(),
+            latencies.groupby(LATENCY_KEYS, sort=True, observed=True).agg({'Count': 'sum'}).reset_index()
+        )
+
+    @property
+    def subjects(self):
+        return list(pd.unique(self.cube['Subject']))
+
+    @property
+    def start_date(self):
+        return self.cube['First'].min()
+
+    @property
+    def end_date(self):
+        return self.cube['Last'].max()
+
+    def __len__(self):
+        return int(self.cube['Messages'].sum())
+
+    def filter(self, start_date=None, end_date=None, subjects=None):
+        """Returns the aggregates restricted to the days between start_date and end_date and to the given subjects."""
+        cube_mask = self._filter_mask(self.cube, start_date, end_date, subjects)
+        conversations_mask = self._filter_mask(self.conversations, start_date, end_date, subjects)
+        replies_mask = self._filter_mask(self.replies, start_date, end_date, subjects)
+        latencies_mask = self._filter_mask(self.latencies, start_date, end_date, subjects)
+        return ChatAggregates(self.cube[cube_mask], self.conversations[conversations_mask], self.replies[replies_mask],
+                              self.latencies[latencies_mask])
+
+    @staticmethod
+    def _filter_mask(table : pd.DataFrame, start_date, end_date, subjects):
+        mask = np.ones(len(table), dtype=bool)
+        if start_date is not None:
+            mask &= (table['Day'] >= pd.Timestamp(start_date).normalize()).values
+        if end_date is not None:
+            mask &= (table['Day'] <= pd.Timestamp(end_date)).values
+        if subjects is not None:
+            mask &= table['Subject'].isin(subjects).values
+            # Replies only stay in when both ends of them are still selected
+            if 'Previous subject' in table.columns:
+                mask &= table['Previous subject'].isin(subjects).values
+        return mask
+
+    def weekly(self, column : str, subjects : list = None):
+        """Weekly totals of a cube column, one column per subject."""
+        daily = self.cube.pivot_table(index='Day', columns='Subject', values=column, aggfunc='sum', fill_value=0,
+                                      observed=True)
+        weekly = daily.resample('W').sum()
+        if subjects is not None:
+            weekly = weekly.reindex(columns=subjects, fill_value=0)
+        return weekly
+
+    @property
+    def text_messages_column(self):
+        # Words are only counted over text messages when the media and deleted markers were computed
+        return 'Text messages' if 'Text messages' in self.cube.columns else 'Messages'
+
+    def weekly_average_words(self, subjects : list = None):
+        # Each subject's words are averaged over every message sent that week, like the old per-subject
+        # mlength columns were
+        weekly_words = self.weekly('Words', subjects)
+        weekly_messages = self.weekly(self.text_messages_column).sum(axis=1)
+        return weekly_words.div(weekly_messages.replace(0, np.nan), axis=0)
+
+    def average_words(self):
+        """Words per text message of each subject."""
+        return self.by_subject('Words') / self.by_subject(self.text_messages_column).replace(0, np.nan)
+
+    def latency_quantiles(self, latency : str = 'Reply time', quantiles : list = (0.5, 0.9, 0.99)):
+        """Quantiles of a LATENCY_MARKERS latency in minutes, one row per subject and one column per quantile."""
+        latencies = self.latencies[self.latencies['Latency'] == latency]
+        return sketch_quantiles(latencies, ['Subject'], list(quantiles))
+
+    def weekly_latency_quantile(self, latency : str = 'Reply time', quantile : float = 0.5, subjects : list = None):
+        """A quantile of a latency for every week, one column per subject, NaN for weeks without any."""
+        latencies = self.latencies[self.latencies['Latency'] == latency]
+        # Labelled by the Sunday they end on, like resample('W') labels them
+        days = latencies['Day']
+        latencies = latencies.assign(Week=days + pd.to_timedelta(6 - days.dt.weekday, unit='D'))
+        weekly = sketch_quantiles(latencies, ['Week', 'Subject'], [quantile])[quantile].unstack('Subject')
+        if len(weekly) > 0:
+            weekly = weekly.resample('W').asfreq()
+        if subjects is not None:
+            weekly = weekly.reindex(columns=subjects)
+        return weekly
+
+    def by_subject(self, column : str):
+        # Observed categorical groups come out in order of appearance, hence the explicit sort
+        return self.cube.groupby('Subject', observed=True)[column].sum().sort_index()
+
+    def by_hour(self, column : str):
+        return self.cube.groupby('Hour', observed=True)[column].sum().sort_index()
+
+    def conversation_sizes(self):
+        """Size and mean date of every conversation, counting only the messages left after filtering."""
+        conversations = self.conversations.groupby('Conv code')[['Messages', 'Date sum']].sum()
+        return pd.DataFrame({
+            'count': conversations['Messages'].values,
+            'mean_date': pd.to_datetime(conversations['Date sum'].values / conversations['Messages'].values, unit='s'),
+        }, index=conversations.index)
+
+    def reply_pairs(self):
+        """
+        Replies and reply times for every (replying subject, subject replied to) pair that has any,
+        i.e. the non-zero entries of the sparse sender by previous sender matrix, most replies first.
+        """
+        pairs = self.replies.groupby(['Subject', 'Previous subject'], observed=True).agg(REPLY_AGGREGATIONS)
+        pairs = pairs[pairs['Replies'] > 0]
+        pairs['Average reply time'] = pairs['Reply time sum'] / pairs['Replies']
+        return pairs.sort_values('Replies', ascending=False)
+
+    def reply_matrix(self, column : str = 'Replies', top : int = None):
+        """
+        A reply_pairs column as a dense matrix, replying subjects as rows and the subjects they replied
+        to as columns, restricted to the top subjects with the most replies sent and received when given.
+        """
+        values = self.reply_pairs()[column]
+        involvement = values.groupby(level=0, observed=True).sum().add(
+            values.groupby(level=1, observed=True).sum(), fill_value=0)
+        involvement.index = involvement.index.astype(str)
+        subjects = list(involvement.sort_values(ascending=False).index[:top])
+        matrix = values.reset_index()
+        matrix = matrix[matrix['Subject'].isin(subjects) & matrix['Previous subject'].isin(subjects)]
+        return matrix.pivot_table(index='Subject', columns='Previous subject', values=column, aggfunc='sum',
+                                  observed=True).reindex(index=subjects, columns=subjects).fillna(0)
@@ -0,0 +1,48 @@
+import contextlib
+import posixpath
+import zipfile
+
+ZIP_MAGIC = b'PK\x03\x04'
+# iOS names the chat _chat.txt, Android names it after the chat, e.g. "WhatsApp Chat with Alice.txt"
+CHAT_MEMBER_NAMES = ('_chat.txt',)
+CHAT_MEMBER_PREFIXES = ('WhatsApp Chat',)
+
+
+def is_zip_file(raw_file_content):
+    raw_file_content.seek(0)
+    header = raw_file_content.read(len(ZIP_MAGIC))
+    raw_file_content.seek(0)
+    return header == ZIP_MAGIC
+
+
+def find_chat_member(archive : zipfile.ZipFile):
+    """The archive member holding the chat text, None when there isn't one."""
+    candidates = [
+        info for info in archive.infolist()
+        if not info.is_dir() and info.filename.lower().endswith('.txt')
+        # macOS adds resource fork copies of every file under __MACOSX
+        and not info.filename.startswith('__MACOSX/')
+    ]
+
+    def rank(info):
+        name = posixpath.basename(info.filename)
+        return name in CHAT_MEMBER_NAMES, name.startswith(CHAT_MEMBER_PREFIXES), info.file_size
+
+    return max(candidates, key=rank, default=None)
+
+
+@contextlib.contextmanager
+def open_chat_member(raw_file_content):
+    """
+    Opens the chat text inside a WhatsApp zip export as a file object that decompresses
+    as it is read, so neither the media nor the whole chat is ever extracted.
+    Yields (chat_file, uncompressed size), or (None, 0) when the archive has no chat in it.
+    """
+    raw_file_content.seek(0)
+    with zipfile.ZipFile(raw_file_content) as archive:
+        member = find_chat_member(archive)
+        if member is None:
+            yield None, 0
+            return
+        with archive.open(member) as chat_file:
+            yield chat_file, member.file_size
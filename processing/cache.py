@@ -0,0 +1,201 @@
+import hashlib
+import os
+import pickle
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+
+import pandas as pd
+
+from processing.storage import save_chat, load_chat
+
+HASH_CHUNK_SIZE = 1 << 20
+# Part of every key, bumped whenever what gets cached changes shape, like a class gaining an attribute, so
+# entries written by an older version are never read back
+CACHE_FORMAT_VERSION = 2
+FRAME_EXTENSION = '.arrow'
+PICKLE_EXTENSION = '.pkl'
+
+
+def content_hash(raw_file_content):
+    """Hashes an uploaded file in chunks, leaving it rewound for whoever reads it next."""
+    hasher = hashlib.sha256()
+    raw_file_content.seek(0)
+    for chunk in iter(lambda: raw_file_content.read(HASH_CHUNK_SIZE), b''):
+        hasher.update(chunk)
+    raw_file_content.seek(0)
+    return hasher.hexdigest()
+
+
+def content_length(raw_file_content):
+    raw_file_content.seek(0, 2)
+    length = raw_file_content.tell()
+    raw_file_content.seek(0)
+    return length
+
+
+def estimate_size(value):
+    if isinstance(value, pd.DataFrame):
+        # Shallow memory usage is cheap to compute and good enough for a budget
+        return int(value.memory_usage(index=True).sum())
+    return len(pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL))
+
+
+class ChatCache:
+    """
+    Two tier cache for processed chats: an in-memory LRU capped by entry count and
+    estimated size, backed by an optional on-disk tier that evicts the least recently
+    used files once it goes over its byte budget. Frames are stored on disk as Arrow
+    files so they are memory-mapped back in, anything else is pickled.
+    Cached values are shared between reruns and sessions, so callers must not mutate them.
+    get_or_compute computes each key once at a time, concurrent callers wait for that result.
+    """
+    def __init__(self, max_entries: int = 8, max_memory_bytes: int = 512 << 20,
+                 disk_dir: str = None, max_disk_bytes: int = 2 << 30):
+        self.max_entries = max_entries
+        self.max_memory_bytes = max_memory_bytes
+        self.disk_dir = disk_dir
+        self.max_disk_bytes = max_disk_bytes
+        self._entries = OrderedDict()
+        self._sizes = {}
+        # Futures of the keys being computed right now
+        self._computing = {}
+        self._lock = threading.RLock()
+        if disk_dir is not None:
+            os.makedirs(disk_dir, exist_ok=True)
+
+    @staticmethod
+    def make_key(chat_hash: str, **params):
+        params_string = ','.join(f'{name}={params[name]!r}' for name in sorted(params))
+        return hashlib.sha256(f'{CACHE_FORMAT_VERSION}|{chat_hash}|{params_string}'.encode('utf-8')).hexdigest()
+
+    def get(self, key: str):
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                return self._entries[key]
+        value = self._read_from_disk(key)
+        if value is not None:
+            self._put_in_memory(key, value)
+        return value
+
+    def put(self, key: str, value):
+        self._put_in_memory(key, value)
+        self._write_to_disk(key, value)
+
+    def get_or_compute(self, key: str, compute):
+        value = self.get(key)
+        if value is not None:
+            return value
+        with self._lock:
+            computing = self._computing.get(key)
+            if computing is None:
+                computing = self._computing[key] = Future()
+                owner = True
+            else:
+                owner = False
+        if not owner:
+            # Another session is already computing it, e.g. parsing the same upload for another threshold
+            return computing.result()
+        try:
+            # Whoever computed it last may have finished between the first look and taking the key
+            value = self.get(key)
+            if value is None:
+                value = compute()
+                # Failed computations aren't cached so their errors show up again on the next try
+                if value is not None:
+                    self.put(key, value)
+        except BaseException as error:
+            computing.set_exception(error)
+            raise
+        else:
+            computing.set_result(value)
+        finally:
+            with self._lock:
+                del self._computing[key]
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._sizes.clear()
+
+    def _put_in_memory(self, key: str, value):
+        size = estimate_size(value)
+        with self._lock:
+            self._entries[key] = value
+            self._sizes[key] = size
+            self._entries.move_to_end(key)
+            # The newest entry is always kept, even if it is bigger than the whole budget
+            while len(self._entries) > 1 and (
+                    len(self._entries) > self.max_entries or sum(self._sizes.values()) > self.max_memory_bytes):
+                evicted_key, _ = self._entries.popitem(last=False)
+                del self._sizes[evicted_key]
+
+    def _disk_path(self, key: str, value=None):
+        extension = FRAME_EXTENSION if isinstance(value, pd.DataFrame) else PICKLE_EXTENSION
+        return os.path.join(self.disk_dir, f'{key}{extension}')
+
+    def _read_from_disk(self, key: str):
+        if self.disk_dir is None:
+            return None
+        frame_path = os.path.join(self.disk_dir, f'{key}{FRAME_EXTENSION}')
+        pickle_path = os.path.join(self.disk_dir, f'{key}{PICKLE_EXTENSION}')
+        try:
+            if os.path.exists(frame_path):
+                path, value = frame_path, load_chat(frame_path)
+            else:
+                with open(pickle_path, 'rb') as file:
+                    path, value = pickle_path, pickle.load(file)
+        except Exception:
+            # Unreadable entries, like pickles of classes a deploy moved or renamed, are misses
+            return None
+        # Touching the file marks it as recently used for eviction
+        os.utime(path)
+        return value
+
+    def _write_to_disk(self, key: str, value):
+        if self.disk_dir is None:
+            return
+        path = self._disk_path(key, value)
+        temp_path = f'{path}.{threading.get_ident()}.tmp'
+        if isinstance(value, pd.DataFrame):
+            save_chat(value, temp_path)
+        else:
+            with open(temp_path, 'wb') as file:
+                pickle.dump(value, file, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temp_path, path)
+        self._evict_from_disk()
+
+    def _evict_from_disk(self):
+        with self._lock:
+            files = []
+            for name in os.listdir(self.disk_dir):
+                if not name.endswith((FRAME_EXTENSION, PICKLE_EXTENSION)):
+                    continue
+                path = os.path.join(self.disk_dir, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                files.append((stat.st_mtime, stat.st_size, path))
+            files.sort()
+            total_size = sum(size for _, size, _ in files)
+            # Leaves at least the newest file in place
+            for _, size, path in files[:-1]:
+                if total_size <= self.max_disk_bytes:
+                    break
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+                total_size -= size
+
+
+# Process-wide cache, shared by every Streamlit session. The disk tier is opt in through the environment
+chat_cache = ChatCache(
+    max_entries=int(os.environ.get('WHATSAPP_ANALYSER_CACHE_ENTRIES', 32)),
+    max_memory_bytes=int(os.environ.get('WHATSAPP_ANALYSER_CACHE_MB', 512)) << 20,
+    disk_dir=os.environ.get('WHATSAPP_ANALYSER_CACHE_DIR'),
+    max_disk_bytes=int(os.environ.get('WHATSAPP_ANALYSER_DISK_CACHE_MB', 2048)) << 20,
+)
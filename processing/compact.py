@@ -0,0 +1,67 @@
+import numpy as np
+import pandas as pd
+from pandas.api.types import union_categoricals
+
+# Narrowest dtypes that still hold every value the preprocessing produces
+COMPACT_DTYPES = {
+    'Message Length': 'int32',
+    'Characters': 'int32',
+    'Emojis': 'int32',
+    'Links': 'int32',
+    'Media': 'bool',
+    'Deleted': 'bool',
+    'Conv code': 'int32',
+    'Conv change': 'bool',
+    'Is reply': 'bool',
+    'Sender change': 'bool',
+    # Both times are whole minutes, which float32 holds exactly for over thirty years
+    'Reply time': 'float32',
+    'Inter conv time': 'float32',
+}
+CATEGORICAL_COLUMNS = ['Subject', 'Previous subject', 'Formatted Date']
+# Arrow backed strings skip the per-message Python object overhead
+MESSAGE_DTYPE = 'string[pyarrow]'
+
+
+def compact_df(df : pd.DataFrame):
+    """Converts a preprocessed chat to its compact dtypes in place and returns it."""
+    for column, dtype in COMPACT_DTYPES.items():
+        if column in df.columns:
+            df[column] = df[column].astype(dtype)
+    for column in CATEGORICAL_COLUMNS:
+        if column in df.columns and not isinstance(df[column].dtype, pd.CategoricalDtype):
+            df[column] = df[column].astype('category')
+    if 'Message' in df.columns:
+        df['Message'] = df['Message'].astype(MESSAGE_DTYPE)
+    return df
+
+
+def concat_frames(frames : list):
+    """pd.concat that keeps categorical columns categorical when the frames have different categories, a single frame is returned as is."""
+    frames = [frame for frame in frames if len(frame) > 0] or frames[:1]
+    if len(frames) == 1:
+        return frames[0]
+    first = frames[0]
+    categorical_columns = [
+        column for column in first.columns if isinstance(first[column].dtype, pd.CategoricalDtype)
+    ]
+    if categorical_columns:
+        frames = [frame.copy(deep=False) for frame in frames]
+        for column in categorical_columns:
+            categories = union_categoricals([frame[column].values for frame in frames]).categories
+            for frame in frames:
+                frame[column] = frame[column].cat.set_categories(categories)
+    return pd.concat(frames)
+
+
+def memory_report(df : pd.DataFrame):
+    """Bytes used by each column (strings included) with their dtypes, plus a total row."""
+    usage = df.memory_usage(index=True, deep=True)
+    report = pd.DataFrame({
+        'dtype': [str(df.index.dtype)] + [str(dtype) for dtype in df.dtypes],
+        'bytes': usage.values,
+    }, index=['Index'] + list(df.columns))
+    report['bytes per message'] = report['bytes'] / max(len(df), 1)
+    report.loc['Total'] = ['', report['bytes'].sum(), report['bytes per message'].sum()]
+    report['bytes'] = report['bytes'].astype(np.int64)
+    return report
@@ -0,0 +1,114 @@
+import re
+import pandas as pd
+
+# Translates strftime directives into the regex fragment that matches them in an export
+FORMAT_DIRECTIVE_PATTERNS = {
+    '%d': r'\d{1,2}',
+    '%m': r'\d{1,2}',
+    '%y': r'\d{2}',
+    '%Y': r'\d{4}',
+    '%H': r'\d{1,2}',
+    '%I': r'\d{1,2}',
+    '%M': r'\d{2}',
+    '%S': r'\d{2}',
+    # Some locales write a.m. and p.m.
+    '%p': r'[AaPp]\.?[Mm]\.?',
+}
+# Android exports look like "3/12/21, 12:34 AM - Alice: hi", iOS ones like "[12.03.21, 14:05:33] Alice: hi"
+ANDROID_HEADER = '{date} - '
+IOS_HEADER = '[{date}] '
+DETECTION_SAMPLE_SIZE = 2000
+# Share of a dialect's matching timestamps that must also parse for the dialect to be picked, a day first
+# chat read as month first only parses on days up to the 12th
+MIN_PARSED_RATIO = 0.9
+
+
+class ExportDialect:
+    """
+    A WhatsApp export layout: the datetime format its timestamps are written in
+    and the header wrapping that timestamp at the start of every message.
+    """
+    def __init__(self, name: str, datetime_format: str, header: str = ANDROID_HEADER):
+        self.name = name
+        self.datetime_format = datetime_format
+        self.header = header
+        self.pattern = re.compile(
+            r'^\u200e?'
+            + re.escape(header).replace(re.escape('{date}'), f'(?P<date>{format_to_regex(datetime_format)})')
+            + r'(?:(?P<subject>[^:]+): )?(?P<message>.*)$'
+        )
+
+    def parse_dates(self, dates):
+        # Some locales put a narrow no-break space before AM/PM, or write it as a.m./p.m.
+        dates = pd.Series(dates, dtype='object')
+        if '%p' in self.datetime_format:
+            dates = dates.str.replace('[\u202f\xa0]', ' ', regex=True).str.replace(
+                r'([AaPp])\.?([Mm])\.?$', r'\1\2', regex=True)
+        return pd.DatetimeIndex(pd.to_datetime(dates, format=self.datetime_format, errors='coerce'))
+
+    def __repr__(self):
+        return f"ExportDialect({self.name!r}, {self.datetime_format!r})"
+
+
+def format_to_regex(datetime_format: str):
+    parts = re.split(r'(%.)', datetime_format)
+    regex = ''
+    for part in parts:
+        if part in FORMAT_DIRECTIVE_PATTERNS:
+            regex += FORMAT_DIRECTIVE_PATTERNS[part]
+        else:
+            regex += re.escape(part).replace(r'\ ', r'[ \u202f\xa0]')
+    return regex
+
+
+DIALECTS = {}
+
+
+def register_dialect(dialect: ExportDialect):
+    DIALECTS[dialect.name] = dialect
+    return dialect
+
+
+def detect_dialect(sample_lines: list):
+    """
+    Picks the registered dialect that best explains a sample of lines, scored by
+    how many of its timestamps parse and, on ties such as day-first and month-first
+    layouts, by how many of them are in chronological order and then by how short
+    a time they span. Dialects whose matching timestamps mostly fail to parse are
+    never picked. Returns None when no dialect explains the sample.
+    """
+    best_dialect = None
+    best_score = (0, 0, 0)
+    for dialect in DIALECTS.values():
+        dates = [match.group('date') for match in map(dialect.pattern.match, sample_lines) if match]
+        if len(dates) == 0:
+            continue
+        parsed = dialect.parse_dates(dates).dropna()
+        if len(parsed) < MIN_PARSED_RATIO * len(dates):
+            continue
+        in_order = int((parsed[1:] >= parsed[:-1]).sum()) if len(parsed) > 1 else 0
+        # Consecutive messages are usually close together, swapping days and months spreads them over months
+        span = (parsed.max() - parsed.min()).total_seconds()
+        score = (len(parsed), in_order, -span)
+        if score > best_score:
+            best_dialect, best_score = dialect, score
+    return best_dialect
+
+
+register_dialect(ExportDialect('English', '%m/%d/%y, %I:%M %p'))
+register_dialect(ExportDialect('English (full year)', '%m/%d/%Y, %I:%M %p'))
+register_dialect(ExportDialect('English (24h)', '%m/%d/%y, %H:%M'))
+register_dialect(ExportDialect('English (full year, 24h)', '%m/%d/%Y, %H:%M'))
+register_dialect(ExportDialect('English (day first)', '%d/%m/%Y, %I:%M %p'))
+register_dialect(ExportDialect('English (day first, short year)', '%d/%m/%y, %I:%M %p'))
+register_dialect(ExportDialect('English (day first, 24h)', '%d/%m/%Y, %H:%M'))
+register_dialect(ExportDialect('English (day first, short year, 24h)', '%d/%m/%y, %H:%M'))
+register_dialect(ExportDialect('English (iOS)', '%m/%d/%y, %I:%M:%S %p', header=IOS_HEADER))
+register_dialect(ExportDialect('English (iOS, full year)', '%m/%d/%Y, %I:%M:%S %p', header=IOS_HEADER))
+register_dialect(ExportDialect('English (iOS, day first)', '%d/%m/%Y, %H:%M:%S', header=IOS_HEADER))
+register_dialect(ExportDialect('English (iOS, day first, 12h)', '%d/%m/%Y, %I:%M:%S %p', header=IOS_HEADER))
+register_dialect(ExportDialect('English (iOS, day first, short year)', '%d/%m/%y, %H:%M:%S', header=IOS_HEADER))
+register_dialect(ExportDialect('German', '%d.%m.%y, %H:%M:%S', header=IOS_HEADER))
+register_dialect(ExportDialect('German (full year)', '%d.%m.%Y, %H:%M:%S', header=IOS_HEADER))
+register_dialect(ExportDialect('German (Android)', '%d.%m.%y, %H:%M'))
+register_dialect(ExportDialect('German (Android, full year)', '%d.%m.%Y, %H:%M'))
@@ -0,0 +1,140 @@
+import json
+import os
+import statistics
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+
+from instrumentation import current_trace, logger, progress_callback, report_progress, start_trace
+
+
+class AnalysisBusy(RuntimeError):
+    """Raised instead of queueing an analysis when too many are already waiting for a worker."""
+
+
+class AnalysisJob:
+    """One analysis submitted to an AnalysisExecutor, shared by every caller that asked for the same key."""
+    def __init__(self, key, name : str):
+        self.key = key
+        self.name = name
+        self.future = Future()
+        self.submitted = time.perf_counter()
+        self.started = None
+        self.progress = 0.0
+        self.trace = None
+
+    def set_progress(self, fraction : float):
+        self.progress = fraction
+
+
+class AnalysisExecutor:
+    """
+    Process-wide pool that runs the expensive analyses of every Streamlit session on a bounded
+    number of worker threads, so concurrent uploads queue up instead of all slowing down together.
+
+    Analyses are keyed, usually by content hash and settings, and a submission whose key is already
+    queued or running joins that job instead of starting another, so two sessions uploading the same
+    chat do the work once. Past max_queued waiting jobs new ones are rejected with AnalysisBusy.
+    Threads rather than processes keep the results in the process-wide chat_cache every session reads.
+    """
+    def __init__(self, workers : int = None, max_queued : int = 32, latency_window : int = 256):
+        if workers is None:
+            workers = min(4, os.cpu_count() or 1)
+        self.workers = workers
+        self.max_queued = max_queued
+        self._executor = None
+        self._jobs = {}
+        self._queued = 0
+        self._running = 0
+        self._counts = {'completed': 0, 'failed': 0, 'rejected': 0, 'coalesced': 0}
+        # (seconds waiting for a worker, seconds running) of the latest finished jobs
+        self._latencies = deque(maxlen=latency_window)
+        self._lock = threading.Lock()
+
+    def submit(self, key, name : str, function, *args, **kwargs):
+        """Returns the AnalysisJob computing function(*args, **kwargs), or the one already computing key."""
+        with self._lock:
+            if key in self._jobs:
+                self._counts['coalesced'] += 1
+                return self._jobs[key]
+            if self._queued >= self.max_queued:
+                self._counts['rejected'] += 1
+                raise AnalysisBusy(f'{self._queued} analyses are already waiting for a worker')
+            job = AnalysisJob(key, name)
+            self._jobs[key] = job
+            self._queued += 1
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='analysis')
+        self._executor.submit(self._run_job, job, function, args, kwargs)
+        return job
+
+    def wait(self, job : AnalysisJob, poll_interval : float = 0.1):
+        """
+        Waits for a submitted job on the calling thread, passing the job's progress on to the caller's
+        report_progress and adding the spans it recorded to the caller's trace, and returns its result.
+        """
+        while not job.future.done():
+            wait([job.future], timeout=poll_interval, return_when=FIRST_COMPLETED)
+            report_progress(job.progress)
+        trace = current_trace()
+        if trace is not None and job.trace is not None:
+            trace.adopt(job.trace)
+        return job.future.result()
+
+    def _run_job(self, job : AnalysisJob, function, args, kwargs):
+        with self._lock:
+            self._queued -= 1
+            self._running += 1
+        job.started = time.perf_counter()
+        # Spans recorded by the job go to a trace of its own, the callers adopt them once it is done
+        job.trace = start_trace(job.name)
+        try:
+            with progress_callback(job.set_progress):
+                result = function(*args, **kwargs)
+        except BaseException as error:
+            self._finish(job, 'failed')
+            job.future.set_exception(error)
+        else:
+            self._finish(job, 'completed')
+            job.future.set_result(result)
+
+    def _finish(self, job : AnalysisJob, outcome : str):
+        finished = time.perf_counter()
+        with self._lock:
+            # Removed before the future resolves so callers that see it done never join a finished job
+            del self._jobs[job.key]
+            self._running -= 1
+            self._counts[outcome] += 1
+            self._latencies.append((job.started - job.submitted, finished - job.started))
+            queued, running = self._queued, self._running
+        logger.info(json.dumps({
+            'executor': job.name,
+            'outcome': outcome,
+            'queued_seconds': job.started - job.submitted,
+            'seconds': finished - job.started,
+            'queue_depth': queued,
+            'running': running,
+        }))
+
+    def metrics(self):
+        """Queue depth, job counts and median and worst wait and run times of the latest jobs, in milliseconds."""
+        with self._lock:
+            latencies = list(self._latencies)
+            metrics = {'workers': self.workers, 'running': self._running, 'queued': self._queued, **self._counts}
+        waits = [queued for queued, _ in latencies] or [0.0]
+        runs = [ran for _, ran in latencies] or [0.0]
+        metrics.update({
+            'median wait ms': round(statistics.median(waits) * 1000, 1),
+            'max wait ms': round(max(waits) * 1000, 1),
+            'median run ms': round(statistics.median(runs) * 1000, 1),
+            'max run ms': round(max(runs) * 1000, 1),
+        })
+        return metrics
+
+
+# Process-wide executor shared by every Streamlit session
+analysis_executor = AnalysisExecutor(
+    workers=int(os.environ['WHATSAPP_ANALYSER_ANALYSIS_WORKERS']) if 'WHATSAPP_ANALYSER_ANALYSIS_WORKERS' in os.environ else None,
+    max_queued=int(os.environ.get('WHATSAPP_ANALYSER_ANALYSIS_QUEUE', 32)),
+)
@@ -0,0 +1,82 @@
+import hashlib
+
+from processing.cache import chat_cache, content_length, HASH_CHUNK_SIZE
+
+# The opening messages of a chat never change between exports, so they identify it
+PREFIX_BYTES = 16 << 10
+
+
+class ChatSnapshot:
+    """
+    Where a processed export of a chat ended: how many bytes it had and their hash, the
+    dialect it was parsed with and the last message, which is all a newer export of the
+    same chat needs to carry on from it.
+    The processed results themselves stay in chat_cache under content_hash.
+    """
+    def __init__(self, content_length : int, content_hash : str, dialect : str, last_date, last_subject : str,
+                 last_conv_code : int = None):
+        self.content_length = content_length
+        self.content_hash = content_hash
+        self.dialect = dialect
+        self.last_date = last_date
+        self.last_subject = last_subject
+        self.last_conv_code = last_conv_code
+
+
+def prefix_fingerprint(raw_file_content):
+    return hash_prefix(raw_file_content, PREFIX_BYTES)
+
+
+def hash_prefix(raw_file_content, length : int):
+    """Same hash as processing.cache.content_hash, over the first length bytes only."""
+    hasher = hashlib.sha256()
+    raw_file_content.seek(0)
+    remaining = length
+    while remaining > 0:
+        chunk = raw_file_content.read(min(HASH_CHUNK_SIZE, remaining))
+        if not chunk:
+            break
+        hasher.update(chunk)
+        remaining -= len(chunk)
+    raw_file_content.seek(0)
+    return hasher.hexdigest()
+
+
+def snapshot_key(raw_file_content, inter_conversation_threshold_time : int, columns : list):
+    # Conversation codes depend on the threshold, so every setting continues from its own snapshot
+    return chat_cache.make_key(
+        prefix_fingerprint(raw_file_content),
+        inter_conversation_threshold_time=inter_conversation_threshold_time,
+        columns=tuple(columns),
+        kind='snapshot'
+    )
+
+
+def remember_export(raw_file_content, chat_hash : str, dialect : str, df, inter_conversation_threshold_time : int,
+                    columns : list):
+    """Records where df, the processed chat_hash export, ended so newer exports of it can be extended."""
+    if dialect is None or len(df) == 0:
+        return
+    snapshot = ChatSnapshot(
+        content_length(raw_file_content),
+        chat_hash,
+        dialect,
+        df.index[-1],
+        df['Subject'].iloc[-1],
+        int(df['Conv code'].iloc[-1]) if 'Conv code' in df.columns else None,
+    )
+    chat_cache.put(snapshot_key(raw_file_content, inter_conversation_threshold_time, columns), snapshot)
+
+
+def find_previous_export(raw_file_content, inter_conversation_threshold_time : int, columns : list):
+    """
+    Snapshot of an older export this file starts with byte for byte, None when this chat
+    hasn't been seen with these settings or the file isn't just the older one plus new messages.
+    """
+    snapshot = chat_cache.get(snapshot_key(raw_file_content, inter_conversation_threshold_time, columns))
+    if snapshot is None or content_length(raw_file_content) <= snapshot.content_length:
+        return None
+    # Hashing the old part is far cheaper than parsing it, and catches edited or differently exported chats
+    if hash_prefix(raw_file_content, snapshot.content_length) != snapshot.content_hash:
+        return None
+    return snapshot
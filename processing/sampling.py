@@ -0,0 +1,38 @@
+import os
+
+# How the quick preview of big uploads samples them, and from what size on it is worth it
+PREVIEW_STRATA = 512
+PREVIEW_WINDOW_BYTES = 8 << 10
+PREVIEW_MIN_BYTES = int(os.environ.get('WHATSAPP_ANALYSER_PREVIEW_MB', 32)) << 20
+
+
+def sample_windows(raw_file_content, total_bytes : int, strata : int = PREVIEW_STRATA,
+                   window_bytes : int = PREVIEW_WINDOW_BYTES):
+    """
+    Reads strata evenly spaced windows of whole lines from a chat export, the first one at its
+    start and the last one at its end. Exports are in chronological order, so the windows are a
+    sample stratified by time that keeps the chat's first and last dates.
+    Returns (lines, weight) pairs, weight being how many bytes of the export each byte of the
+    window stands for.
+    """
+    if total_bytes <= strata * window_bytes:
+        # Small enough to read whole, which makes the sample exact
+        strata, window_bytes = 1, total_bytes
+    stride = (total_bytes - window_bytes) / max(strata - 1, 1)
+    windows = []
+    for stratum in range(strata):
+        start = int(stratum * stride)
+        raw_file_content.seek(start)
+        window = raw_file_content.read(window_bytes)
+        # Windows are cut down to whole lines, lines that continue a message from before the window are
+        # skipped by the parser like anything else before the first message header
+        if start > 0:
+            window = window[window.find(b'\n') + 1:]
+        if start + window_bytes < total_bytes:
+            window = window[:window.rfind(b'\n') + 1]
+        if len(window) == 0:
+            continue
+        lines = window.decode('utf-8-sig' if start == 0 else 'utf-8', errors='replace').splitlines()
+        windows.append((lines, total_bytes / strata / len(window)))
+    raw_file_content.seek(0)
+    return windows
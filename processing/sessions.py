@@ -0,0 +1,61 @@
+import numpy as np
+import pandas as pd
+
+# Columns the session index derives, everything except Sender change depends on the threshold
+SESSION_COLUMNS = ['Conv code', 'Conv change', 'Is reply', 'Sender change', 'Reply time', 'Inter conv time']
+
+
+class SessionIndex:
+    """
+    The gaps between consecutive messages of a chat, sorted once so conversations can be
+    derived for any inter conversation threshold without going back to the messages.
+
+    Conversation counts are a binary search over the sorted gaps, the per message columns of
+    preprocess_df are a single vectorised pass. A message starts a conversation when the gap
+    before it is longer than the threshold, the first message never does.
+    """
+    def __init__(self, deltas : np.ndarray, subject_codes : np.ndarray, subjects : list):
+        self.deltas = deltas
+        self.subject_codes = subject_codes
+        self.subjects = list(subjects)
+        self.sender_changed = np.roll(subject_codes, 1) != subject_codes
+        self.sender_changed[:1] = False
+        self._sorted_deltas = np.sort(deltas)
+
+    @classmethod
+    def from_df(cls, df : pd.DataFrame):
+        index = df.index.values
+        # The first message has no previous one, so its gap is zero
+        deltas = np.diff(index, prepend=index[:1]).astype('timedelta64[ns]')
+        subject_codes, subjects = pd.factorize(df['Subject'], sort=True)
+        return cls(deltas, subject_codes.astype(np.int32), subjects)
+
+    def __len__(self):
+        return len(self.deltas)
+
+    @staticmethod
+    def _threshold(inter_conversation_threshold_time : int):
+        return np.timedelta64(inter_conversation_threshold_time, 'm')
+
+    def conversation_count(self, inter_conversation_threshold_time : int = 60):
+        if len(self) == 0:
+            return 0
+        # Everything after the last gap that fits within the threshold starts a conversation
+        first_start = np.searchsorted(self._sorted_deltas, self._threshold(inter_conversation_threshold_time),
+                                      side='right')
+        return 1 + len(self) - first_start
+
+    def columns(self, inter_conversation_threshold_time : int = 60):
+        """The columns cluster_into_conversations, find_replies and calculate_times_on_trues produce for this threshold."""
+        # One comparison over every gap is cheaper than scattering the boundaries
+        conv_changes = self.deltas > self._threshold(inter_conversation_threshold_time)
+        is_reply = self.sender_changed & ~conv_changes
+        minutes = self.deltas.astype('timedelta64[m]').astype('float')
+        return {
+            'Conv code': np.cumsum(conv_changes),
+            'Conv change': conv_changes,
+            'Is reply': is_reply,
+            'Sender change': self.sender_changed,
+            'Reply time': np.where(is_reply, minutes, 0),
+            'Inter conv time': np.where(conv_changes, minutes, 0),
+        }
@@ -0,0 +1,47 @@
+import numpy as np
+import pandas as pd
+
+# Quantiles read from a sketch are within this relative error of the exact ones
+RELATIVE_ACCURACY = 0.01
+GAMMA = (1 + RELATIVE_ACCURACY) / (1 - RELATIVE_ACCURACY)
+# Zero minute gaps are common and have no logarithm, they all share this bucket
+ZERO_BUCKET = np.iinfo(np.int32).min
+
+
+def bucket_index(values : np.ndarray):
+    """
+    The sketch bucket of every non negative value, bucket i holding the values in (GAMMA ** (i - 1), GAMMA ** i].
+    Counting values per bucket gives a DDSketch: buckets are the same for every sketch, so sketches of any
+    days or subjects merge by adding up their counts, and quantiles come out within RELATIVE_ACCURACY.
+    """
+    values = np.asarray(values, dtype=np.float64)
+    buckets = np.full(len(values), ZERO_BUCKET, dtype=np.int32)
+    positive = values > 0
+    buckets[positive] = np.ceil(np.log(values[positive]) / np.log(GAMMA)).astype(np.int32)
+    return buckets
+
+
+def bucket_value(buckets : np.ndarray):
+    """The value each bucket stands for, the one with the same relative error to both of the bucket's ends."""
+    buckets = np.asarray(buckets)
+    values = 2 * GAMMA ** buckets.astype(np.float64) / (GAMMA + 1)
+    return np.where(buckets == ZERO_BUCKET, 0.0, values)
+
+
+def sketch_quantiles(counts : pd.DataFrame, groups : list, quantiles : list):
+    """
+    Quantiles of the sketches in counts, a table of Count per Bucket, after merging every row that shares
+    the groups columns. Returns one row per group and one column per quantile.
+    """
+    merged = counts.groupby(groups + ['Bucket'], sort=True, observed=True)['Count'].sum()
+    merged = merged[merged > 0].reset_index()
+    grouped = merged.groupby(groups, sort=False, observed=True)['Count']
+    cumulative = grouped.cumsum().values
+    total = grouped.transform('sum').values
+    result = {}
+    for quantile in quantiles:
+        # Same rank as DDSketch, the first bucket whose cumulative count goes past it holds the quantile
+        reached = merged[cumulative > quantile * (total - 1)]
+        first = reached.groupby(groups, sort=True, observed=True)['Bucket'].first()
+        result[quantile] = pd.Series(bucket_value(first.values), index=first.index)
+    return pd.DataFrame(result)
@@ -0,0 +1,95 @@
+import json
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.feather as feather
+
+ARROW_MAGIC = b'ARROW1'
+PARQUET_MAGIC = b'PAR1'
+# Schema metadata key holding df.attrs, such as the dialect a newer export is parsed with
+ATTRS_METADATA_KEY = b'whatsapp_analyser.attrs'
+ARROW_STRING_TYPES = {
+    pa.string(): pd.StringDtype('pyarrow'),
+    pa.large_string(): pd.StringDtype('pyarrow'),
+}
+
+
+def save_chat(df : pd.DataFrame, path : str):
+    """
+    Writes a preprocessed chat to a columnar file, Parquet when the path ends in
+    .parquet and otherwise uncompressed Arrow IPC (Feather v2), which can be memory-mapped.
+    """
+    table = pa.Table.from_pandas(df, preserve_index=True)
+    table = table.replace_schema_metadata({
+        **(table.schema.metadata or {}),
+        ATTRS_METADATA_KEY: json.dumps(df.attrs).encode('utf-8'),
+    })
+    if path.endswith('.parquet'):
+        import pyarrow.parquet as pq
+        pq.write_table(table, path)
+    else:
+        # Compressed record batches would have to be decompressed into memory instead of mapped
+        feather.write_feather(table, path, compression='uncompressed')
+
+
+def load_chat(source, columns : list = None):
+    """
+    Loads a chat written by save_chat, reading only the requested columns it has plus the index.
+    source can be a path, which is memory-mapped, or a file-like object such as an upload.
+    """
+    source = _as_arrow_source(source)
+    if _is_parquet(source):
+        # Parquet support is only loaded once a Parquet file shows up, the cache only ever writes Arrow
+        import pyarrow.parquet as pq
+        schema = pq.read_schema(source)
+        table = pq.read_table(source, columns=_with_index_columns(schema, columns), memory_map=True)
+    else:
+        if isinstance(source, str):
+            source = pa.memory_map(source, 'r')
+        schema = pa.ipc.open_file(source).schema
+        table = feather.read_table(source, columns=_with_index_columns(schema, columns), memory_map=True)
+    # Splitting blocks stops pandas from copying every numeric column into one consolidated block, and
+    # strings stay Arrow backed like compact_df leaves them
+    df = table.to_pandas(split_blocks=True, types_mapper=ARROW_STRING_TYPES.get)
+    attrs = (schema.metadata or {}).get(ATTRS_METADATA_KEY)
+    if attrs is not None:
+        df.attrs.update(json.loads(attrs))
+    return df
+
+
+def is_columnar_file(raw_file_content):
+    raw_file_content.seek(0)
+    header = raw_file_content.read(len(ARROW_MAGIC))
+    raw_file_content.seek(0)
+    return header.startswith(ARROW_MAGIC) or header.startswith(PARQUET_MAGIC)
+
+
+def _as_arrow_source(source):
+    if isinstance(source, str):
+        return source
+    # Uploads are already in memory, wrapping their buffer avoids copying them again
+    if hasattr(source, 'getbuffer'):
+        return pa.BufferReader(pa.py_buffer(source.getbuffer()))
+    return pa.BufferReader(source.read())
+
+
+def _is_parquet(source):
+    if isinstance(source, str):
+        with open(source, 'rb') as file:
+            header = file.read(len(PARQUET_MAGIC))
+    else:
+        header = source.read(len(PARQUET_MAGIC))
+        source.seek(0)
+    return header == PARQUET_MAGIC
+
+
+def _with_index_columns(schema : pa.Schema, columns : list):
+    if columns is None:
+        return None
+    index_columns = [
+        column for column in (schema.pandas_metadata or {}).get('index_columns', [])
+        if isinstance(column, str)
+    ]
+    return [column for column in columns if column in schema.names] + [
+        column for column in index_columns if column not in columns
+    ]
@@ -0,0 +1,66 @@
+import pandas as pd
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+except ImportError:
+    pa = pc = None
+
+# Every column text_stats can compute
+TEXT_STAT_COLUMNS = ['Message Length', 'Characters', 'Emojis', 'Media', 'Deleted', 'Links']
+
+# Android writes <Media omitted>, iOS e.g. "image omitted" or "<file name> document omitted"
+MEDIA_PATTERN = r'<Media omitted>$|(?:image|video|audio|sticker|GIF|document|Contact card) omitted$'
+DELETED_PATTERN = '^\u200e?(?:This message was deleted|You deleted this message)'
+LINK_PATTERN = r'(?:https?://|www\.)\S+'
+# Pictographs, emoticons, transport and symbols, without the skin tone modifiers that only change the emoji before them
+ARROW_EMOJI_PATTERN = r'[\x{1F300}-\x{1F3FA}\x{1F400}-\x{1FAFF}\x{2600}-\x{27BF}]'
+PYTHON_EMOJI_PATTERN = '[\U0001F300-\U0001F3FA\U0001F400-\U0001FAFF\u2600-\u27BF]'
+
+
+def text_stats(messages : pd.Series, columns : list = None):
+    """
+    Per message text statistics, all of them or only the given TEXT_STAT_COLUMNS:
+    Message Length (words, counted like len(message.split(' '))), Characters, Emojis, Links
+    and whether the message is a Media placeholder or a Deleted message notice.
+    Arrow backed messages are processed by pyarrow.compute kernels without creating a Python
+    string per message, anything else falls back to the equivalent pandas string methods.
+    """
+    columns = TEXT_STAT_COLUMNS if columns is None else columns
+    arrow_messages = _as_arrow(messages)
+    stats = {}
+    for column in columns:
+        if arrow_messages is not None:
+            values = ARROW_KERNELS[column](arrow_messages).to_numpy(zero_copy_only=False)
+        else:
+            values = PANDAS_KERNELS[column](messages.astype(object)).to_numpy()
+        stats[column] = values
+    return stats
+
+
+def _as_arrow(messages : pd.Series):
+    if pc is None or not all(hasattr(pc, kernel) for kernel in ('count_substring', 'count_substring_regex')):
+        return None
+    if not isinstance(messages.dtype, pd.StringDtype) or messages.dtype.storage != 'pyarrow':
+        return None
+    # Messages are never missing, empty strings keep the kernels' results free of nulls
+    return pc.fill_null(pa.array(messages.array), '')
+
+
+ARROW_KERNELS = {
+    'Message Length': lambda messages: pc.add(pc.count_substring(messages, ' '), 1),
+    'Characters': lambda messages: pc.utf8_length(messages),
+    'Emojis': lambda messages: pc.count_substring_regex(messages, ARROW_EMOJI_PATTERN),
+    'Media': lambda messages: pc.match_substring_regex(messages, MEDIA_PATTERN),
+    'Deleted': lambda messages: pc.match_substring_regex(messages, DELETED_PATTERN),
+    'Links': lambda messages: pc.count_substring_regex(messages, LINK_PATTERN),
+}
+
+PANDAS_KERNELS = {
+    'Message Length': lambda messages: messages.str.count(' ') + 1,
+    'Characters': lambda messages: messages.str.len(),
+    'Emojis': lambda messages: messages.str.count(PYTHON_EMOJI_PATTERN),
+    'Media': lambda messages: messages.str.contains(MEDIA_PATTERN),
+    'Deleted': lambda messages: messages.str.contains(DELETED_PATTERN),
+    'Links': lambda messages: messages.str.count(LINK_PATTERN),
+}
@@ -0,0 +1,75 @@
+"""
+Extends the cached results of the sample export cut short at line 6000 with the rest of it and compares
+them with the results of processing the whole sample from scratch. The cut falls inside a conversation,
+so the boundary message's conversation, reply and reply time have to carry on across it.
+Aggregate tables are compared after sorting, merging appends the new rows' groups after the old ones.
+"""
+import io
+import os
+
+import pandas as pd
+import pytest
+
+from data_utils import (aggregates_columns, extend_previous_aggregates, extend_previous_df, get_aggregates_from_data,
+                        get_df_from_data, hash_upload, required_columns)
+from processing.aggregates import CONVERSATION_KEYS, CUBE_KEYS, LATENCY_KEYS, REPLY_KEYS
+from processing.cache import chat_cache
+
+SAMPLE_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'sample_whatsapp_export.txt')
+SPLIT_LINE = 6000
+THRESHOLD = 60
+
+
+def sorted_table(table : pd.DataFrame, keys : list):
+    # Categories are ordered by appearance, which differs between the two, so keys are compared as strings
+    table = table.astype({key: str for key in keys if isinstance(table[key].dtype, pd.CategoricalDtype)})
+    return table.sort_values(keys).reset_index(drop=True)
+
+
+@pytest.fixture(scope='module')
+def exports():
+    with open(SAMPLE_PATH, 'rb') as file:
+        lines = file.readlines()
+    return io.BytesIO(b''.join(lines[:SPLIT_LINE])), io.BytesIO(b''.join(lines))
+
+
+@pytest.fixture
+def previous_export(exports):
+    # Processing the older export is what caches its results and where it ended
+    previous, _ = exports
+    chat_cache.clear()
+    previous_df = get_df_from_data(previous, THRESHOLD)
+    get_aggregates_from_data(previous, THRESHOLD)
+    yield previous_df
+    chat_cache.clear()
+
+
+def full_rebuild(export, build):
+    chat_cache.clear()
+    return build(export, THRESHOLD)
+
+
+def test_extended_df_equals_full_rebuild(exports, previous_export):
+    _, export = exports
+    extended = extend_previous_df(export, hash_upload(export), THRESHOLD, required_columns())
+    assert extended is not None
+    full = full_rebuild(export, get_df_from_data)
+
+    # The first new message carries on the previous export's last conversation
+    assert not full['Conv change'].iloc[len(previous_export)]
+    assert full['Conv code'].iloc[len(previous_export)] == previous_export['Conv code'].iloc[-1]
+    pd.testing.assert_frame_equal(extended, full, check_categorical=False)
+
+
+def test_extended_aggregates_equal_full_rebuild(exports, previous_export):
+    _, export = exports
+    extended = extend_previous_aggregates(export, hash_upload(export), THRESHOLD, aggregates_columns())
+    assert extended is not None
+    full = full_rebuild(export, get_aggregates_from_data)
+
+    assert extended.subjects == full.subjects
+    for table, keys in [('cube', CUBE_KEYS), ('conversations', CONVERSATION_KEYS), ('replies', REPLY_KEYS),
+                        ('latencies', LATENCY_KEYS)]:
+        pd.testing.assert_frame_equal(sorted_table(getattr(extended, table), keys),
+                                      sorted_table(getattr(full, table), keys),
+                                      check_dtype=False, check_categorical=False)
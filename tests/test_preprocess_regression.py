@@ -0,0 +1,164 @@
+"""
+Runs the original parse and preprocess_df, kept below as they were before they were vectorised, and the
+current ones on the sample export and compares their frames column by column.
+
+Differences that are intended:
+- the original parser skipped the first ten messages, so the current frame is compared from the eleventh
+- the original gave the chat's last conversation the code of the one before it
+- the original cut the last character off the file's final line, a message character when, like the sample, it has no newline
+- per subject columns are no longer stored, they are grouped from the categorical Subject instead
+- columns are stored in compact dtypes, so values are compared rather than dtypes
+"""
+import os
+import re
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from data_utils import create_df_from_raw_file, preprocess_df
+
+SAMPLE_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'sample_whatsapp_export.txt')
+IGNORED_ROWS = 10
+COMPARED_COLUMNS = ['Date', 'Subject', 'Message', 'Message Length', 'Formatted Date', 'Conv change', 'Is reply',
+                    'Sender change', 'Reply time', 'Inter conv time', 'Hour']
+
+
+def original_create_df_from_raw_file(raw_file_content):
+    # The English branch of the original parser, without its debug prints
+    rows = [row.decode('utf-8')[:-1] for row in raw_file_content.readlines()]
+    valid_rows = [row for row in rows if re.match(r'^\d*/\d*/\d*', row)]
+    datetime = pd.DatetimeIndex([row.split(' - ')[0] for row in valid_rows[IGNORED_ROWS:]])
+    subjects = [row.split(', ')[1].split(' - ')[1].split(':')[0] for row in valid_rows[IGNORED_ROWS:]]
+    messages = [(':'.join(row.split(', ')[1].split(' - ')[1].split(': ')[1:])) for row in valid_rows[IGNORED_ROWS:]]
+    return pd.DataFrame(
+        zip(pd.to_datetime(datetime), subjects, messages),
+        columns=['Date', 'Subject', 'Message'],
+        index=datetime
+    )
+
+
+def original_preprocess_df(df):
+    df['Message Length'] = df['Message'].apply(lambda x: len(x.split(' ')))
+    for subject in df['Subject'].unique():
+        df[subject] = df['Subject'].apply(lambda x: 1 if x == subject else 0)
+        df[f"{subject}_mlength"] = df[subject].values * df['Message Length']
+
+    df['Formatted Date'] = df.index.strftime('%b - %y').values
+
+    conv_codes, conv_changes = original_cluster_into_conversations(df)
+    df['Conv code'] = conv_codes
+    df['Conv change'] = conv_changes
+    is_reply, sender_changes = original_find_replies(df)
+    df['Is reply'] = is_reply
+    df['Sender change'] = sender_changes
+
+    reply_times, indices = original_calculate_times_on_trues(df, 'Is reply')
+    reply_times_df_list = []
+    reply_time_index = 0
+    for i in range(0, len(df)):
+        if i in indices:
+            reply_times_df_list.append(reply_times[reply_time_index].astype("timedelta64[m]").astype("float"))
+            reply_time_index = reply_time_index + 1
+        else:
+            reply_times_df_list.append(0)
+    df['Reply time'] = reply_times_df_list
+
+    inter_conv_times, indices = original_calculate_times_on_trues(df, 'Conv change')
+    inter_conv_times_df_list = []
+    inter_conv_time_index = 0
+    for i in range(0, len(df)):
+        if i in indices:
+            inter_conv_times_df_list.append(
+                inter_conv_times[inter_conv_time_index].astype("timedelta64[m]").astype("float"))
+            inter_conv_time_index = inter_conv_time_index + 1
+        else:
+            inter_conv_times_df_list.append(0)
+    df['Inter conv time'] = inter_conv_times_df_list
+
+    df['Hour'] = df['Date'].apply(lambda x: x.strftime('%H'))
+    return df
+
+
+def original_cluster_into_conversations(df, inter_conversation_threshold_time=60):
+    threshold_time_mins = np.timedelta64(inter_conversation_threshold_time, 'm')
+    conv_delta = df.index.values - np.roll(df.index.values, 1)
+    conv_delta[0] = 0
+    conv_changes = conv_delta > threshold_time_mins
+    conv_changes_indices = np.where(conv_changes)[0]
+    conv_codes = []
+    last_conv_change = 0
+    for i, conv_change in enumerate(conv_changes_indices):
+        conv_codes.extend([i]*(conv_change - last_conv_change))
+        last_conv_change = conv_change
+    conv_codes = original_pad_list_to_value(conv_codes, len(df), conv_codes[-1])
+    conv_changes = original_pad_list_to_value(conv_changes, len(df), False)
+    return conv_codes, conv_changes
+
+
+def original_pad_list_to_value(input_list, length, value):
+    output_list = list(input_list)
+    output_list.extend([value]*(length - len(output_list)))
+    return np.array(output_list)
+
+
+def original_find_replies(df):
+    # The original used scikit-learn's OrdinalEncoder, which numbers the sorted subjects just like this
+    message_senders = np.unique(df['Subject'].values, return_inverse=True)[1].astype(float)
+    sender_changed = (np.roll(message_senders, 1) - message_senders) != 0
+    sender_changed[0] = False
+    is_reply = sender_changed & ~df['Conv change']
+    return is_reply, sender_changed
+
+
+def original_calculate_times_on_trues(df, column):
+    true_indices = np.where(df[column])[0]
+    inter_conv_time = [df.index.values[ind] - df.index.values[ind-1] for ind in true_indices]
+    return inter_conv_time, true_indices
+
+
+@pytest.fixture(scope='module')
+def frames():
+    with open(SAMPLE_PATH, 'rb') as raw_file_content:
+        original = original_preprocess_df(original_create_df_from_raw_file(raw_file_content))
+    with open(SAMPLE_PATH, 'rb') as raw_file_content:
+        parsed = create_df_from_raw_file(raw_file_content)
+    current = preprocess_df(parsed.iloc[IGNORED_ROWS:].copy())
+    return original, current
+
+
+def test_same_messages(frames):
+    original, current = frames
+    assert len(current) == len(original)
+    assert (current.index.values == original.index.values).all()
+
+
+@pytest.mark.parametrize('column', COMPARED_COLUMNS)
+def test_same_column(frames, column):
+    original, current = frames
+    expected = original[column].values
+    actual = np.asarray(current[column].astype(object) if column in ('Subject', 'Message', 'Formatted Date', 'Hour')
+                        else current[column].values)
+    if column == 'Message':
+        assert actual[-1][:-1] == expected[-1]
+        actual, expected = actual[:-1], expected[:-1]
+    if expected.dtype.kind == 'f':
+        np.testing.assert_allclose(actual.astype(float), expected)
+    else:
+        assert (actual == expected).all()
+
+
+def test_same_conversation_codes_but_the_last(frames):
+    original, current = frames
+    last_conversation = current['Conv code'].values == current['Conv code'].values[-1]
+    assert (current['Conv code'].values[~last_conversation] == original['Conv code'].values[~last_conversation]).all()
+    assert (original['Conv code'].values[last_conversation] == original['Conv code'].values[-1]).all()
+    assert current['Conv code'].values[-1] == original['Conv code'].values[-1] + 1
+
+
+def test_per_subject_columns_are_grouped_instead(frames):
+    original, current = frames
+    for subject in original['Subject'].unique():
+        is_subject = (current['Subject'] == subject).values
+        assert (is_subject.astype(int) == original[subject].values).all()
+        assert (np.where(is_subject, current['Message Length'].values, 0) == original[f'{subject}_mlength'].values).all()
@@ -0,0 +1,79 @@
+"""
+Checks the latency quantile sketches against exact quantiles, on synthetic latencies and on the sample
+export's reply and inter conversation times, and that merging the aggregates of two parts of the sample
+gives the aggregates of the whole of it.
+
+DDSketch ranks quantiles without interpolating, so the exact quantiles are numpy's 'lower' ones.
+"""
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from data_utils import parse_and_preprocess
+from processing.aggregates import ChatAggregates, CONVERSATION_KEYS, CUBE_KEYS, LATENCY_KEYS, REPLY_KEYS
+from processing.sketches import bucket_index, RELATIVE_ACCURACY, sketch_quantiles
+
+SAMPLE_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'sample_whatsapp_export.txt')
+QUANTILES = [0.01, 0.1, 0.25, 0.5, 0.75, 0.9, 0.99, 1.0]
+# numpy 1.22 renamed interpolation to method
+LOWER_QUANTILE = ({'method': 'lower'} if np.lib.NumpyVersion(np.__version__) >= '1.22.0'
+                  else {'interpolation': 'lower'})
+
+
+def exact_quantiles(values : np.ndarray):
+    return np.quantile(np.asarray(values, dtype=np.float64), QUANTILES, **LOWER_QUANTILE)
+
+
+def assert_within_accuracy(estimated : np.ndarray, exact : np.ndarray):
+    # Zero latencies have their own bucket and come out exactly
+    assert (np.abs(estimated - exact) <= RELATIVE_ACCURACY * exact + 1e-9).all()
+
+
+def sorted_table(table : pd.DataFrame, keys : list):
+    # Categories are ordered by appearance, which differs between the two, so keys are compared as strings
+    table = table.astype({key: str for key in keys if isinstance(table[key].dtype, pd.CategoricalDtype)})
+    return table.sort_values(keys).reset_index(drop=True)
+
+
+@pytest.fixture(scope='module')
+def sample_df():
+    with open(SAMPLE_PATH, 'rb') as raw_file_content:
+        return parse_and_preprocess(raw_file_content)
+
+
+@pytest.mark.parametrize('distribution', ['exponential', 'lognormal', 'mostly zero'])
+def test_sketch_quantiles_within_accuracy(distribution):
+    generator = np.random.default_rng(0)
+    values = {
+        'exponential': lambda: generator.exponential(30, 10000),
+        'lognormal': lambda: generator.lognormal(2, 2, 10000),
+        'mostly zero': lambda: np.where(generator.random(10000) < 0.8, 0, generator.exponential(5, 10000)),
+    }[distribution]()
+    buckets, counts = np.unique(bucket_index(values), return_counts=True)
+    sketch = pd.DataFrame({'Group': 0, 'Bucket': buckets, 'Count': counts})
+
+    estimated = sketch_quantiles(sketch, ['Group'], QUANTILES).loc[0].values
+    assert_within_accuracy(estimated, exact_quantiles(values))
+
+
+@pytest.mark.parametrize('latency, marker', [('Reply time', 'Is reply'), ('Inter conv time', 'Conv change')])
+def test_latency_quantiles_within_accuracy(sample_df, latency, marker):
+    estimated = ChatAggregates.from_df(sample_df).latency_quantiles(latency, QUANTILES)
+    for subject, messages in sample_df[sample_df[marker]].groupby('Subject', observed=True):
+        assert_within_accuracy(estimated.loc[subject].values, exact_quantiles(messages[latency].values))
+
+
+def test_merge_equals_aggregating_the_whole(sample_df):
+    split = len(sample_df) // 2
+    merged = ChatAggregates.from_df(sample_df.iloc[:split]).merge(ChatAggregates.from_df(sample_df.iloc[split:]))
+    whole = ChatAggregates.from_df(sample_df)
+
+    for table, keys in [('cube', CUBE_KEYS), ('conversations', CONVERSATION_KEYS), ('replies', REPLY_KEYS),
+                        ('latencies', LATENCY_KEYS)]:
+        pd.testing.assert_frame_equal(sorted_table(getattr(merged, table), keys),
+                                      sorted_table(getattr(whole, table), keys),
+                                      check_dtype=False, check_categorical=False)
+    pd.testing.assert_frame_equal(merged.latency_quantiles('Reply time', QUANTILES),
+                                  whole.latency_quantiles('Reply time', QUANTILES))